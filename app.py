@@ -3,38 +3,71 @@
 """
 import os
 import json
+import logging
 import csv
 import io
+import gzip
+import http.client
 import subprocess
-import urllib.request
-import urllib.error
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
 
 # アプリバージョン
 APP_VERSION = "1.5.0"
+APP_VERSION_TUPLE = tuple(int(x) for x in APP_VERSION.split('.'))
 GITHUB_REPO = "matdonaruno/patho-record"
 
 from flask import (
     Flask, render_template, request, jsonify, session,
     redirect, url_for, flash, Response
 )
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson  # 任意: インストール済みなら JSON レスポンスの生成に使用
+except ImportError:
+    orjson = None
 
 from config import Config
 from models import db, User, ItemLog, AuditLog, AppSettings
 from logger import setup_logger, get_audit_logger
-from nas_check import NASChecker
+from nas_check import (
+    NASChecker, probe_smb_port, parse_smb_shares, SMB_VERSIONS, MOUNT_TIMEOUT, is_fatal_mount_error
+)
 from usb_check import USBChecker
-from backup import BackupManager, check_storage_on_startup, get_backup_type
+from backup import (
+    BackupManager, check_storage_on_startup, get_backup_type, invalidate_backup_type_cache,
+    read_checksum, calculate_backup_sha256, is_timestamped_name, ZSTD_SUFFIX
+)
 from validators import (
     ValidationError, validate_barcode, validate_patient_id,
     validate_notes, validate_quantity, validate_user_name,
     validate_password, validate_return_days, sanitize_input
 )
 
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON レスポンス用プロバイダ（キーの並べ替えを省き、orjson があれば使用）"""
+    sort_keys = False
+    ensure_ascii = False
+
+    def dumps(self, obj, **kwargs):
+        # インデント指定（デバッグ時）や orjson 未インストール時は標準の json を使う
+        if orjson is None or kwargs.get('indent'):
+            return super().dumps(obj, **kwargs)
+        # datetime などは標準と同じ default で変換（出力形式を変えない）
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+
 # Flask アプリ初期化
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = FastJSONProvider(app)
 
 
 # テンプレートにバージョンを渡す（キャッシュバスティング用）
@@ -63,6 +96,14 @@ audit_logger = get_audit_logger()
 # バックアップマネージャー
 backup_manager = BackupManager()
 
+# バックアップジョブ用ワーカー（1本で直列化）
+backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup-job')
+# job_id -> {'future': Future, 'finished_at': 完了時刻}（投入順。_backup_jobs_lock で保護）
+backup_jobs = OrderedDict()
+_backup_jobs_lock = threading.Lock()
+BACKUP_JOBS_MAX = 20
+BACKUP_JOB_TTL = 600.0  # 完了済みジョブの結果を保持する秒数
+
 
 # ============================================================
 # ユーティリティ
@@ -96,18 +137,19 @@ def create_audit_log(action, table_name, record_id, old_value=None, new_value=No
         table_name=table_name,
         record_id=record_id,
         user_id=user.id if user else None,
-        old_value=json.dumps(old_value, ensure_ascii=False) if old_value else None,
-        new_value=json.dumps(new_value, ensure_ascii=False) if new_value else None
+        old_value=old_value or None,
+        new_value=new_value or None
     )
     db.session.add(log)
     db.session.commit()
 
-    # ファイルログにも出力
-    audit_logger.info(
-        f"ACTION={action} TABLE={table_name} RECORD={record_id} "
-        f"USER={user.name if user else 'SYSTEM'} "
-        f"OLD={old_value} NEW={new_value}"
-    )
+    # ファイルログにも出力（無効時はメッセージの組み立て自体を省く）
+    if audit_logger.isEnabledFor(logging.INFO):
+        audit_logger.info(
+            f"ACTION={action} TABLE={table_name} RECORD={record_id} "
+            f"USER={user.name if user else 'SYSTEM'} "
+            f"OLD={old_value} NEW={new_value}"
+        )
 
 
 # ============================================================
@@ -317,6 +359,7 @@ def scan():
         patient_id=patient_id,
         quantity=quantity,
         scanned_by_id=user.id,
+        scanned_by_name=user.name,
         expected_return_date=expected_return_date,
         returned=returned,
         block_quantity=block_quantity,
@@ -412,6 +455,7 @@ def return_create():
         barcode=barcode,
         quantity=1,
         scanned_by_id=user.id,
+        scanned_by_name=user.name,
         expected_return_date=expected_return_date,
         returned=False,
         completed=False,
@@ -450,7 +494,7 @@ def history():
     per_page = int(request.args.get('per_page', 50))
 
     # ベースクエリ（削除されていないもの）
-    query = ItemLog.query.filter(ItemLog.deleted_at == None)
+    query = ItemLog.query_for_list().filter(ItemLog.deleted_at == None)
 
     # フィルタ適用
     if filter_type == 'unreturned':
@@ -512,8 +556,9 @@ def history():
     # ページネーション
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
+    now = datetime.utcnow()
     return jsonify({
-        'items': [item.to_dict() for item in pagination.items],
+        'items': [item.to_dict(now) for item in pagination.items],
         'total': pagination.total,
         'pages': pagination.pages,
         'current_page': page,
@@ -711,6 +756,11 @@ def update_user(user_id):
             existing = User.query.filter(User.name == name, User.id != user_id).first()
             if existing:
                 return jsonify({'error': 'この名前は既に使用されています'}), 400
+            if name != user.name:
+                # 履歴に保持しているスキャン者名も更新
+                ItemLog.query.filter_by(scanned_by_id=user.id).update(
+                    {'scanned_by_name': name}, synchronize_session=False
+                )
             user.name = name
 
         if 'is_active' in data:
@@ -793,7 +843,7 @@ def export_csv():
     search = request.args.get('search', '').strip()
 
     # クエリ構築
-    query = ItemLog.query.filter(ItemLog.deleted_at == None)
+    query = ItemLog.query_for_list().filter(ItemLog.deleted_at == None)
 
     if filter_type == 'unreturned':
         query = query.filter(ItemLog.completed == False)
@@ -829,7 +879,7 @@ def export_csv():
             item.id,
             item.barcode,
             item.quantity,
-            item.scanned_by.name if item.scanned_by else '',
+            item.scanned_by_name or '',
             item.scanned_at.strftime('%Y-%m-%d %H:%M:%S') if item.scanned_at else '',
             item.block_quantity or '',
             item.slide_quantity or '',
@@ -894,7 +944,7 @@ def audit_logs():
     page = int(request.args.get('page', 1))
     per_page = int(request.args.get('per_page', 50))
 
-    query = AuditLog.query.order_by(AuditLog.timestamp.desc())
+    query = AuditLog.query_for_list().order_by(AuditLog.timestamp.desc())
     pagination = query.paginate(page=page, per_page=per_page, error_out=False)
 
     return jsonify({
@@ -1039,6 +1089,7 @@ def settings_backup_type():
         return jsonify({'error': 'バックアップタイプは usb または nas を指定してください'}), 400
 
     AppSettings.set('backup_type', new_type)
+    invalidate_backup_type_cache()
 
     user = get_current_user()
     logger.info(f"バックアップタイプを変更: {new_type} (ユーザー: {user.name})")
@@ -1058,20 +1109,24 @@ def settings_storage_config():
         return jsonify({'error': '管理者権限が必要です'}), 403
 
     if request.method == 'GET':
-        # 現在の設定を取得
+        # 現在の設定を取得（NAS / USB の全キーを1回のクエリで）
+        stored = AppSettings.get_many([
+            'nas_host', 'nas_share', 'nas_username', 'nas_password', 'nas_mount_point', 'nas_backup_folder',
+            'usb_uuid', 'usb_mount_point', 'usb_backup_folder',
+        ])
         return jsonify({
             'nas': {
-                'host': AppSettings.get('nas_host', Config.NAS_HOST or ''),
-                'share': AppSettings.get('nas_share', Config.NAS_SHARE or ''),
-                'username': AppSettings.get('nas_username', Config.NAS_USERNAME or ''),
-                'password': '***' if AppSettings.get('nas_password', Config.NAS_PASSWORD) else '',
-                'mount_point': AppSettings.get('nas_mount_point', Config.NAS_MOUNT_POINT or '/mnt/nas_backup'),
-                'backup_folder': AppSettings.get('nas_backup_folder', Config.NAS_BACKUP_FOLDER or 'barcode_app_backups'),
+                'host': stored.get('nas_host', Config.NAS_HOST or ''),
+                'share': stored.get('nas_share', Config.NAS_SHARE or ''),
+                'username': stored.get('nas_username', Config.NAS_USERNAME or ''),
+                'password': '***' if stored.get('nas_password', Config.NAS_PASSWORD) else '',
+                'mount_point': stored.get('nas_mount_point', Config.NAS_MOUNT_POINT or '/mnt/nas_backup'),
+                'backup_folder': stored.get('nas_backup_folder', Config.NAS_BACKUP_FOLDER or 'barcode_app_backups'),
             },
             'usb': {
-                'uuid': AppSettings.get('usb_uuid', Config.USB_UUID or ''),
-                'mount_point': AppSettings.get('usb_mount_point', Config.USB_MOUNT_POINT or '/media/usb_backup'),
-                'backup_folder': AppSettings.get('usb_backup_folder', Config.USB_BACKUP_FOLDER or 'barcode_app_backups'),
+                'uuid': stored.get('usb_uuid', Config.USB_UUID or ''),
+                'mount_point': stored.get('usb_mount_point', Config.USB_MOUNT_POINT or '/media/usb_backup'),
+                'backup_folder': stored.get('usb_backup_folder', Config.USB_BACKUP_FOLDER or 'barcode_app_backups'),
             }
         })
 
@@ -1129,16 +1184,9 @@ def nas_auto_detect():
 
     import subprocess
 
-    # 1. ping で到達確認
-    try:
-        result = subprocess.run(
-            ['ping', '-c', '1', '-W', '2', host],
-            capture_output=True, text=True, timeout=5
-        )
-        if result.returncode != 0:
-            return jsonify({'error': f'{host} に接続できません。IPアドレスを確認してください'}), 400
-    except Exception:
-        return jsonify({'error': f'{host} への接続がタイムアウトしました'}), 400
+    # 1. SMBポートへの TCP 接続で到達確認
+    if not probe_smb_port(host):
+        return jsonify({'error': f'{host} に接続できません。IPアドレスを確認してください'}), 400
 
     # 2. smbclient で共有フォルダを検出（SMB1/SMB2/SMB3対応）
     shares = []
@@ -1154,21 +1202,12 @@ def nas_auto_detect():
         for cmd in smb_protocols:
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
             if result.returncode == 0 or 'Sharename' in result.stdout:
-                # 共有フォルダをパース
-                in_share_section = False
-                for line in result.stdout.split('\n'):
-                    if 'Sharename' in line and 'Type' in line:
-                        in_share_section = True
-                        continue
-                    if in_share_section:
-                        if line.strip() == '' or 'Reconnecting' in line:
-                            break
-                        parts = line.split()
-                        if len(parts) >= 2 and parts[1] == 'Disk':
-                            share_name = parts[0]
-                            # システム共有を除外
-                            if not share_name.startswith('IPC') and not share_name.endswith('$'):
-                                shares.append(share_name)
+                # 共有フォルダをパース（システム共有を除外）
+                shares = [
+                    share['name'] for share in parse_smb_shares(result.stdout)
+                    if share['type'] == 'Disk'
+                    and not share['name'].startswith('IPC') and not share['name'].endswith('$')
+                ]
                 if shares:
                     break
             smb_error = result.stderr
@@ -1213,13 +1252,12 @@ def nas_auto_detect():
             os.makedirs(mount_point, exist_ok=True)
 
         smb_path = f"//{host}/{detected_share}"
-        smb_versions = ['1.0', '2.0', '2.1', '3.0']
 
-        for vers in smb_versions:
+        for vers in SMB_VERSIONS:
             mount_options = f"guest,uid=1000,gid=1000,iocharset=utf8,vers={vers}"
             result = subprocess.run(
                 ['sudo', 'mount', '-t', 'cifs', smb_path, mount_point, '-o', mount_options],
-                capture_output=True, text=True, timeout=15
+                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=MOUNT_TIMEOUT
             )
             if result.returncode == 0:
                 mount_success = True
@@ -1228,6 +1266,9 @@ def nas_auto_detect():
             else:
                 mount_error = result.stderr.strip()
                 logger.debug(f"SMB {vers} マウント失敗: {mount_error}")
+                # 認証失敗などはバージョンを変えても同じため打ち切る
+                if is_fatal_mount_error(mount_error):
+                    break
     except subprocess.TimeoutExpired:
         mount_error = "マウントタイムアウト"
     except Exception as e:
@@ -1314,12 +1355,6 @@ def backup_verify():
                 local_backups.append(os.path.join(Config.BACKUP_DIR, f))
     local_backups.sort(reverse=True)
 
-    if not local_backups:
-        return jsonify({'success': False, 'error': 'ローカルバックアップが見つかりません'})
-
-    latest_local = local_backups[0]
-    filename = os.path.basename(latest_local)
-
     # バックアップタイプに応じてリモートパスを取得
     backup_type = get_backup_type()
     if backup_type == 'nas':
@@ -1333,7 +1368,39 @@ def backup_verify():
     if not backup_dir:
         return jsonify({'success': False, 'error': 'リモートストレージに接続できません'})
 
+    # 外部ストレージに直接書き出したバックアップ（ローカルに実体なし）が最新の場合は
+    # 書き出し時のチェックサムと照合する
+    try:
+        remote_names = [f for f in os.listdir(backup_dir) if f.endswith('.db') and is_timestamped_name(f)]
+    except OSError:
+        remote_names = []
+    latest_remote = max(remote_names, default=None)
+    if latest_remote and (not local_backups or latest_remote > os.path.basename(local_backups[0])):
+        remote_path = os.path.join(backup_dir, latest_remote)
+        expected_hash = read_checksum(remote_path)
+        try:
+            if expected_hash is None:
+                result = {'success': False, 'error': 'チェックサムファイルが見つかりません（直接書き出しのバックアップ）'}
+            elif calculate_backup_sha256(remote_path) == expected_hash:
+                result = {'success': True, 'message': 'バックアップ検証成功', 'hash': expected_hash}
+            else:
+                result = {'success': False, 'error': 'ハッシュ不一致（直接書き出しのバックアップ）'}
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        result['filename'] = latest_remote
+        result['backup_type'] = backup_type
+        return jsonify(result)
+
+    if not local_backups:
+        return jsonify({'success': False, 'error': 'ローカルバックアップが見つかりません'})
+
+    latest_local = local_backups[0]
+    filename = os.path.basename(latest_local)
+
     remote_path = os.path.join(backup_dir, filename)
+    # zstd 圧縮してコピーされている場合
+    if not os.path.exists(remote_path) and os.path.exists(remote_path + ZSTD_SUFFIX):
+        remote_path += ZSTD_SUFFIX
 
     # 検証実行
     if backup_type == 'nas':
@@ -1344,6 +1411,13 @@ def backup_verify():
         try:
             if not os.path.exists(remote_path):
                 result = {'success': False, 'error': 'リモートファイルが存在しません'}
+            elif remote_path.endswith(ZSTD_SUFFIX):
+                # 圧縮ファイルはサイズで比較できないため、展開後の内容のハッシュで比較
+                local_hash = read_checksum(latest_local) or calculate_backup_sha256(latest_local)
+                if calculate_backup_sha256(remote_path) == local_hash:
+                    result = {'success': True, 'message': 'バックアップ検証成功', 'hash': local_hash}
+                else:
+                    result = {'success': False, 'error': 'ハッシュ不一致（圧縮バックアップ）'}
             else:
                 local_size = os.path.getsize(latest_local)
                 remote_size = os.path.getsize(remote_path)
@@ -1359,6 +1433,72 @@ def backup_verify():
     return jsonify(result)
 
 
+def submit_backup_job():
+    """バックアップをワーカースレッドに投入し、ジョブIDを返す"""
+    def job():
+        with app.app_context():
+            # ワーカー上なので外部ストレージへのコピー完了まで待つ
+            return backup_manager.create_backup(wait_for_copy=True)
+
+    def mark_finished(_future):
+        with _backup_jobs_lock:
+            entry['finished_at'] = time.monotonic()
+
+    job_id = uuid.uuid4().hex
+    entry = {'future': backup_executor.submit(job), 'finished_at': None}
+    with _backup_jobs_lock:
+        backup_jobs[job_id] = entry
+        _prune_backup_jobs()
+    # 既に完了していればこの場で呼ばれるため、ロックの外で登録する
+    entry['future'].add_done_callback(mark_finished)
+    return job_id
+
+
+def _prune_backup_jobs():
+    """保持期限を過ぎた完了済みジョブを削除し、上限を超えた分は古い順に削除（_backup_jobs_lock 内で呼ぶ）"""
+    now = time.monotonic()
+    expired = [
+        job_id for job_id, entry in backup_jobs.items()
+        if entry['finished_at'] is not None and now - entry['finished_at'] > BACKUP_JOB_TTL
+    ]
+    for job_id in expired:
+        del backup_jobs[job_id]
+    while len(backup_jobs) > BACKUP_JOBS_MAX:
+        backup_jobs.popitem(last=False)
+
+
+@app.route('/settings/backup-status/<job_id>')
+@login_required
+def backup_job_status(job_id):
+    """バックアップジョブの状態を取得"""
+    user = get_current_user()
+    if not user.is_admin:
+        return jsonify({'error': '管理者権限が必要です'}), 403
+
+    with _backup_jobs_lock:
+        _prune_backup_jobs()
+        entry = backup_jobs.get(job_id)
+    if entry is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+
+    future = entry['future']
+
+    if not future.done():
+        return jsonify({'done': False})
+
+    try:
+        success, message, path = future.result()
+    except Exception as e:
+        success, message, path = False, str(e), None
+
+    return jsonify({
+        'done': True,
+        'success': success,
+        'message': message,
+        'path': path
+    })
+
+
 @app.route('/settings/insert-demo-data', methods=['POST'])
 @login_required
 def insert_demo_data():
@@ -1379,6 +1519,7 @@ def insert_demo_data():
                 patient_id=f"P{timestamp}{i}",
                 notes=f"バックアップテスト用デモデータ #{i+1}",
                 scanned_by_id=user.id,
+                scanned_by_name=user.name,
                 quantity=1,
                 expected_return_date=datetime.utcnow() + timedelta(days=14)
             )
@@ -1388,22 +1529,15 @@ def insert_demo_data():
         db.session.commit()
         logger.info(f"デモデータ挿入: {len(demo_items)}件 (ユーザー: {user.name})")
 
-        # バックアップを実行
-        success, message, path = backup_manager.create_backup()
+        # バックアップをワーカーで実行（完了は /settings/backup-status で確認）
+        job_id = submit_backup_job()
 
-        if success:
-            return jsonify({
-                'success': True,
-                'demo_items': demo_items,
-                'backup_path': path,
-                'message': f'{len(demo_items)}件のデモデータを挿入し、バックアップを作成しました'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'demo_items': demo_items,
-                'error': f'デモデータは挿入しましたが、バックアップに失敗しました: {message}'
-            })
+        return jsonify({
+            'success': True,
+            'demo_items': demo_items,
+            'job_id': job_id,
+            'message': f'{len(demo_items)}件のデモデータを挿入しました。バックアップを実行中...'
+        }), 202
 
     except Exception as e:
         db.session.rollback()
@@ -1480,7 +1614,7 @@ def add_fstab_entry():
     if not user.is_admin:
         return jsonify({'error': '管理者権限が必要です'}), 403
 
-    from nas_check import generate_fstab_entry, NASChecker
+    from nas_check import generate_fstab_entry, is_in_fstab, NASChecker
     entry = generate_fstab_entry()
 
     if not entry:
@@ -1490,14 +1624,10 @@ def add_fstab_entry():
     mount_point = checker.mount_point
 
     try:
-        # 1. 既存のfstabを読み込み
-        with open('/etc/fstab', 'r') as f:
-            fstab_content = f.read()
-
-        # 2. 既にエントリが存在するか確認
-        if mount_point in fstab_content:
+        # 1-2. 既にエントリが存在するか確認（コメント行・前方一致は除外）
+        if is_in_fstab(mount_point):
             # 既存エントリがある場合はマウントのみ試行
-            result = subprocess.run(['sudo', 'mount', '-a'], capture_output=True, text=True, timeout=30)
+            result = subprocess.run(['sudo', 'mount', '-a'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=30)
             if result.returncode == 0 and os.path.ismount(mount_point):
                 return jsonify({
                     'success': True,
@@ -1513,7 +1643,7 @@ def add_fstab_entry():
         # 3. fstabにエントリを追加
         add_result = subprocess.run(
             ['sudo', 'bash', '-c', f'echo "{entry}" >> /etc/fstab'],
-            capture_output=True, text=True, timeout=10
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=10
         )
         if add_result.returncode != 0:
             return jsonify({
@@ -1525,10 +1655,11 @@ def add_fstab_entry():
 
         # 4. マウントポイントディレクトリを作成
         if not os.path.exists(mount_point):
-            subprocess.run(['sudo', 'mkdir', '-p', mount_point], capture_output=True, timeout=5)
+            subprocess.run(['sudo', 'mkdir', '-p', mount_point],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=5)
 
         # 5. mount -a でマウント
-        mount_result = subprocess.run(['sudo', 'mount', '-a'], capture_output=True, text=True, timeout=30)
+        mount_result = subprocess.run(['sudo', 'mount', '-a'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, timeout=30)
 
         if mount_result.returncode == 0 and os.path.ismount(mount_point):
             return jsonify({
@@ -1570,43 +1701,119 @@ def get_version():
     })
 
 
+# GitHubリリース情報のキャッシュ（条件付きリクエスト用）
+UPDATE_CHECK_TTL = 300  # 秒
+_release_cache = {
+    'etag': None,
+    'last_modified': None,
+    'payload': None,
+    'fetched_at': 0.0
+}
+
+# GitHub API への接続（keep-alive で使い回す）
+GITHUB_API_HOST = 'api.github.com'
+_github_conn = None
+_github_lock = threading.Lock()
+
+
+def github_api_get(path, headers=None):
+    """
+    GitHub API に GET リクエストを送信（接続再利用・gzip対応）
+    Returns: (status: int, response headers, body: bytes)
+    """
+    global _github_conn
+    request_headers = {
+        'User-Agent': 'Patho-Return-App',
+        'Accept-Encoding': 'gzip'
+    }
+    request_headers.update(headers or {})
+
+    with _github_lock:
+        for attempt in range(2):
+            if _github_conn is None:
+                _github_conn = http.client.HTTPSConnection(GITHUB_API_HOST, timeout=10)
+            try:
+                _github_conn.request('GET', path, headers=request_headers)
+                response = _github_conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                # サーバー側で切断された keep-alive 接続は1回だけ張り直す
+                _github_conn.close()
+                _github_conn = None
+                if attempt:
+                    raise
+                continue
+
+            if response.getheader('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            return response.status, response.headers, body
+
+
+def fetch_latest_release():
+    """
+    GitHubの最新リリース情報を取得
+    TTL内はキャッシュを返し、期限切れ後は ETag / Last-Modified で条件付きリクエスト
+    """
+    now = time.monotonic()
+    cached = _release_cache['payload']
+    if cached is not None and now - _release_cache['fetched_at'] < UPDATE_CHECK_TTL:
+        return cached
+
+    headers = {}
+    if cached is not None:
+        if _release_cache['etag']:
+            headers['If-None-Match'] = _release_cache['etag']
+        if _release_cache['last_modified']:
+            headers['If-Modified-Since'] = _release_cache['last_modified']
+
+    status, response_headers, body = github_api_get(
+        f"/repos/{GITHUB_REPO}/releases/latest", headers
+    )
+
+    if status == 304 and cached is not None:
+        # 304 Not Modified: キャッシュをそのまま使用
+        payload = cached
+    elif status == 200:
+        payload = json.loads(body.decode('utf-8'))
+        _release_cache['etag'] = response_headers.get('ETag')
+        _release_cache['last_modified'] = response_headers.get('Last-Modified')
+    else:
+        raise http.client.HTTPException(f'GitHub API エラー: HTTP {status}')
+
+    _release_cache['payload'] = payload
+    _release_cache['fetched_at'] = now
+    return payload
+
+
 @app.route('/settings/check-update')
 @login_required
 def check_update():
     """GitHubから最新バージョンを確認"""
     try:
-        url = f"https://api.github.com/repos/{GITHUB_REPO}/releases/latest"
-        req = urllib.request.Request(url, headers={'User-Agent': 'Patho-Return-App'})
-        with urllib.request.urlopen(req, timeout=10) as response:
-            data = json.loads(response.read().decode('utf-8'))
-            latest_version = data.get('tag_name', '').lstrip('v')
-            release_name = data.get('name', '')
-            release_body = data.get('body', '')
-            published_at = data.get('published_at', '')
-
-            # バージョン比較（簡易版）
-            current_parts = [int(x) for x in APP_VERSION.split('.')]
-            latest_parts = [int(x) for x in latest_version.split('.') if x.isdigit()]
-
-            has_update = False
-            if len(latest_parts) >= 3:
-                for i in range(min(len(current_parts), len(latest_parts))):
-                    if latest_parts[i] > current_parts[i]:
-                        has_update = True
-                        break
-                    elif latest_parts[i] < current_parts[i]:
-                        break
+        data = fetch_latest_release()
+        latest_version = data.get('tag_name', '').lstrip('v')
+        release_name = data.get('name', '')
+        release_body = data.get('body', '')
+        published_at = data.get('published_at', '')
+
+        # バージョン比較（タプル比較）。数字3つ以外のタグ（v1.6.0-beta 等）は更新扱いにしない
+        latest_parts = latest_version.split('.')
+        has_update = (
+            len(latest_parts) == 3
+            and all(x.isdigit() for x in latest_parts)
+            and tuple(int(x) for x in latest_parts) > APP_VERSION_TUPLE
+        )
 
-            return jsonify({
-                'success': True,
-                'current_version': APP_VERSION,
-                'latest_version': latest_version,
-                'has_update': has_update,
-                'release_name': release_name,
-                'release_notes': release_body,
-                'published_at': published_at
-            })
-    except urllib.error.URLError as e:
+        return jsonify({
+            'success': True,
+            'current_version': APP_VERSION,
+            'latest_version': latest_version,
+            'has_update': has_update,
+            'release_name': release_name,
+            'release_notes': release_body,
+            'published_at': published_at
+        })
+    except OSError:
         return jsonify({
             'success': False,
             'error': 'ネットワークエラー: インターネット接続を確認してください',
@@ -1648,9 +1855,7 @@ def do_update():
                 })
             else:
                 # アップデートがあった場合、自動再起動をスケジュール
-                import threading
                 def delayed_restart():
-                    import time
                     time.sleep(2)  # レスポンスを返す時間を確保
                     restart_app()
 
@@ -1741,6 +1946,10 @@ def auto_update():
         return False, str(e)
 
 
+# マイグレーションのバージョン（適用済みのバージョンは DB の PRAGMA user_version に記録）
+MIGRATION_VERSION = 5
+
+
 def auto_migrate():
     """起動時の自動マイグレーション"""
     import sqlite3
@@ -1755,6 +1964,11 @@ def auto_migrate():
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
+        # 適用済みなら終了（DB 内に記録するため、古いバックアップを戻した場合も再適用される）
+        if cursor.execute("PRAGMA user_version").fetchone()[0] >= MIGRATION_VERSION:
+            conn.close()
+            return
+
         # patient_id列が既に存在するか確認
         cursor.execute("PRAGMA table_info(item_logs)")
         columns = [column[1] for column in cursor.fetchall()]
@@ -1762,21 +1976,47 @@ def auto_migrate():
         if 'patient_id' not in columns:
             logger.info("マイグレーション: patient_id列を追加しています...")
 
-            # patient_id列を追加
-            cursor.execute("""
-                ALTER TABLE item_logs
-                ADD COLUMN patient_id TEXT
-            """)
-
-            # インデックスを作成
-            cursor.execute("""
+            # 列追加とインデックス作成を1トランザクションで実行
+            conn.executescript("""
+                BEGIN;
+                ALTER TABLE item_logs ADD COLUMN patient_id TEXT;
                 CREATE INDEX IF NOT EXISTS ix_item_logs_patient_id
-                ON item_logs (patient_id)
+                    ON item_logs (patient_id);
+                COMMIT;
             """)
 
-            conn.commit()
             logger.info("マイグレーション: patient_id列を追加しました")
 
+        # v3: 一覧用の部分インデックスに置き換え、選択性の低い completed 単独インデックスを削除
+        conn.executescript("""
+            BEGIN;
+            CREATE INDEX IF NOT EXISTS ix_open_scan
+                ON item_logs (scanned_at)
+                WHERE deleted_at IS NULL AND completed = 0;
+            CREATE INDEX IF NOT EXISTS ix_patient_open
+                ON item_logs (patient_id, scanned_at)
+                WHERE deleted_at IS NULL;
+            DROP INDEX IF EXISTS ix_item_logs_completed;
+            COMMIT;
+        """)
+
+        # v4: スキャン者名を履歴に保持（一覧で users との結合を不要にする）
+        if 'scanned_by_name' not in columns:
+            logger.info("マイグレーション: scanned_by_name列を追加しています...")
+            conn.executescript("""
+                BEGIN;
+                ALTER TABLE item_logs ADD COLUMN scanned_by_name VARCHAR(100);
+                UPDATE item_logs SET scanned_by_name =
+                    (SELECT name FROM users WHERE users.id = item_logs.scanned_by_id);
+                COMMIT;
+            """)
+            logger.info("マイグレーション: scanned_by_name列を追加しました")
+
+        # v5: どのクエリにも使われていなかった期限超過用の部分インデックスを削除
+        conn.execute("DROP INDEX IF EXISTS ix_open_overdue")
+
+        # 適用済みバージョンを記録
+        conn.execute(f"PRAGMA user_version = {MIGRATION_VERSION}")
         conn.close()
 
     except Exception as e:
@@ -1822,6 +2062,25 @@ def check_and_run_daily_backup():
         return False, message
 
 
+def start_daily_backup_thread():
+    """初回起動時バックアップをバックグラウンドで実行（サーバー起動を待たせない）"""
+    def worker():
+        with app.app_context():
+            try:
+                backup_success, backup_message = check_and_run_daily_backup()
+            except Exception as e:
+                logger.error(f"初回起動バックアップエラー: {e}")
+                return
+        if backup_success:
+            print(f"💾 バックアップ: {backup_message}")
+        else:
+            print(f"⚠️  バックアップ: {backup_message}")
+
+    thread = threading.Thread(target=worker, name='daily-backup', daemon=True)
+    thread.start()
+    return thread
+
+
 # ============================================================
 # メイン
 # ============================================================
@@ -1855,13 +2114,8 @@ if __name__ == '__main__':
     # 自動マイグレーション
     auto_migrate()
 
-    # その日の初回起動時バックアップ
-    with app.app_context():
-        backup_success, backup_message = check_and_run_daily_backup()
-        if backup_success:
-            print(f"💾 バックアップ: {backup_message}")
-        else:
-            print(f"⚠️  バックアップ: {backup_message}")
+    # その日の初回起動時バックアップ（バックグラウンド実行）
+    start_daily_backup_thread()
 
     # アプリ起動
     print("\n🎀 バーコード管理アプリを起動しています...")
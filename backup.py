@@ -3,8 +3,15 @@
 USB/NAS両対応
 """
 import os
+import bisect
+import errno
 import shutil
 import sqlite3
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from datetime import datetime, timedelta
 from config import Config
 import logging
@@ -12,48 +19,265 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+# get_backup_type() の短時間キャッシュ: (値, expires_at)
+BACKUP_TYPE_CACHE_TTL = 1.0
+_backup_type_cache = (None, 0.0)
+
+
 def get_backup_type():
     """現在のバックアップタイプを取得（AppSettings優先、フォールバック: Config）"""
+    global _backup_type_cache
+    value, expires_at = _backup_type_cache
+    if value is not None and time.monotonic() < expires_at:
+        return value
+
     try:
         from flask import has_app_context
         if has_app_context():
             from models import AppSettings
-            value = AppSettings.get('backup_type')
-            if value:
-                return value
+            value = AppSettings.get('backup_type') or Config.BACKUP_TYPE
+            _backup_type_cache = (value, time.monotonic() + BACKUP_TYPE_CACHE_TTL)
+            return value
     except (RuntimeError, ImportError):
         # Flaskコンテキスト外
         pass
     return Config.BACKUP_TYPE
 
 
+def invalidate_backup_type_cache():
+    """バックアップタイプのキャッシュを破棄（設定変更時に呼ぶ）"""
+    global _backup_type_cache
+    _backup_type_cache = (None, 0.0)
+
+
+def bind_app_context(func):
+    """
+    現在のFlaskアプリコンテキストを引き継いで func を実行するラッパーを返す
+    （ワーカースレッドから AppSettings を参照するため）
+    """
+    try:
+        from flask import current_app, has_app_context
+    except ImportError:
+        return func
+    if not has_app_context():
+        return func
+
+    app = current_app._get_current_object()
+
+    def wrapper(*args, **kwargs):
+        with app.app_context():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def is_timestamped_name(filename):
+    """ファイル名が YYYYMMDD_HHMMSS で始まるか判定"""
+    return (
+        len(filename) >= 15
+        and filename[:8].isdigit()
+        and filename[8] == '_'
+        and filename[9:15].isdigit()
+    )
+
+
+# ストレージ接続状態のキャッシュ有効期間（秒）
+STORAGE_CHECK_TTL = 5.0
+
+CHECKSUM_SUFFIX = '.sha256'
+HASH_CHUNK_SIZE = 1024 * 1024  # 1MiB
+
+
+def write_checksum(file_path):
+    """ファイルのSHA-256を計算し、サイドカーファイル（.sha256）に保存"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hash_sha256.update(chunk)
+    digest = hash_sha256.hexdigest()
+
+    # sha256sum 互換フォーマット
+    with open(file_path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(f'{digest}  {os.path.basename(file_path)}\n')
+    return digest
+
+
+def read_checksum(file_path):
+    """サイドカーファイルからSHA-256を読み込む（なければNone）"""
+    try:
+        with open(file_path + CHECKSUM_SUFFIX, 'r') as f:
+            return f.read().split()[0]
+    except (OSError, IndexError):
+        return None
+
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # 8MiB
+
+
+def fast_copy(src, dst):
+    """
+    ファイルをコピーしてメタデータも複製（shutil.copy2 相当）
+    Linux では sendfile でカーネル内コピーし、非対応環境は shutil.copyfile を使用
+    """
+    copied = False
+    if hasattr(os, 'sendfile'):
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                offset = 0
+                while True:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, COPY_CHUNK_SIZE)
+                    if sent == 0:
+                        break
+                    offset += sent
+            copied = True
+        except OSError as e:
+            # macOS 等、ファイル間の sendfile に対応していない場合
+            if e.errno not in (errno.EINVAL, errno.ENOTSOCK, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+
+    if not copied:
+        shutil.copyfile(src, dst)
+    shutil.copystat(src, dst)
+
+
+ZSTD_SUFFIX = '.zst'
+BACKUP_SUFFIXES = ('.db', '.db' + ZSTD_SUFFIX)
+ZSTD_CHUNK_SIZE = 4 * 1024 * 1024  # 4MiB
+
+
+def copy_backup_file(src, dst):
+    """
+    バックアップを外部ストレージへコピー
+    BACKUP_COMPRESS=zstd の場合は zstd（レベル1）で圧縮して dst + '.zst' に書き出す
+    Returns: 実際に書き出したパス
+    """
+    if Config.BACKUP_COMPRESS == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("zstandard が未インストールのため非圧縮でコピーします")
+        else:
+            dst += ZSTD_SUFFIX
+            tmp_path = dst + '.tmp'
+            cctx = zstandard.ZstdCompressor(level=1, threads=-1)
+            with open(src, 'rb') as fsrc, open(tmp_path, 'wb') as fdst:
+                cctx.copy_stream(fsrc, fdst, read_size=ZSTD_CHUNK_SIZE, write_size=ZSTD_CHUNK_SIZE)
+            shutil.copystat(src, tmp_path)
+            # 書き込み途中の .zst が一覧に出ないよう、完成後に rename する
+            os.replace(tmp_path, dst)
+            return dst
+
+    fast_copy(src, dst)
+    return dst
+
+
+def calculate_backup_sha256(file_path):
+    """バックアップのSHA-256を計算（.zst は展開後の内容で計算）"""
+    hash_sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        if file_path.endswith(ZSTD_SUFFIX):
+            import zstandard
+            reader = zstandard.ZstdDecompressor().stream_reader(f)
+            for chunk in iter(lambda: reader.read(HASH_CHUNK_SIZE), b''):
+                hash_sha256.update(chunk)
+        else:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+
+def preallocate_db_file(file_path, size):
+    """
+    SQLite DB ファイルの領域を事前確保する（非対応環境では何もしない）
+    ゼロ埋めだけのファイルは SQLite が開けないため、先にヘッダーページを書いてから確保する
+    """
+    if not hasattr(os, 'posix_fallocate') or size <= 0:
+        return
+    try:
+        conn = sqlite3.connect(file_path, isolation_level=None)
+        try:
+            conn.execute('PRAGMA user_version=1')  # ヘッダーページを書き出す
+        finally:
+            conn.close()
+        with open(file_path, 'r+b') as f:
+            os.posix_fallocate(f.fileno(), 0, size)
+    except (OSError, sqlite3.Error) as e:
+        # FAT32 など fallocate 非対応のファイルシステムではそのまま続行
+        logger.debug(f"領域の事前確保をスキップ: {str(e)}")
+
+
+def drop_page_cache(file_path, sync=False):
+    """
+    ファイルをページキャッシュから解放（posix_fadvise対応環境のみ）
+    sync=True の場合は書き込み済みデータを先にディスクへ反映する
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            if sync:
+                os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"ページキャッシュ解放失敗: {file_path}: {e}")
+
+
 class BackupManager:
     """バックアップ管理"""
 
     def __init__(self):
-        self.backup_dir = Config.BACKUP_DIR
+        # パスは初期化時に一度だけ組み立てる
+        self.backup_dir = Path(Config.BACKUP_DIR)
         self.retention_days = Config.BACKUP_RETENTION_DAYS
-        self.db_path = os.path.join(Config.BASE_DIR, Config.DATABASE_PATH)
-        self._storage_checker = None
+        self.db_path = Path(Config.BASE_DIR) / Config.DATABASE_PATH
+        # ストレージチェッカーと外部ディレクトリの短期キャッシュ: (backup_type, 値, expires_at)
+        self._checker_cache = (None, None, 0.0)
+        self._ext_dir_cache = (None, None, 0.0)
+        # ローカル/外部ストレージの走査を並行実行するためのプール
+        self._scan_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='backup-scan')
+        # 外部ストレージへのコピー用（1本で直列化）
+        self._copy_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='backup-copy')
+        self._last_copy_future = None
+        # ディレクトリ一覧キャッシュ: path -> (expires_at, dir_mtime, entries)
+        self._listing_cache = {}
+        self._listing_lock = threading.Lock()
 
     @property
     def storage_checker(self):
-        """バックアップタイプに応じたストレージチェッカーを返す"""
-        backup_type = get_backup_type()
+        """バックアップタイプに応じたストレージチェッカーを返す（短時間キャッシュ）"""
+        return self._get_storage_checker(get_backup_type())
+
+    def _get_storage_checker(self, backup_type):
+        """指定タイプのストレージチェッカーを返す（短時間キャッシュ）"""
+        cached_type, checker, expires_at = self._checker_cache
+        if checker is not None and cached_type == backup_type and time.monotonic() < expires_at:
+            return checker
+
         if backup_type == 'usb':
             from usb_check import USBChecker
-            return USBChecker()
+            checker = USBChecker()
         else:
             from nas_check import NASChecker
-            return NASChecker()
+            checker = NASChecker()
+        self._checker_cache = (backup_type, checker, time.monotonic() + STORAGE_CHECK_TTL)
+        return checker
+
+    def invalidate_storage_cache(self):
+        """ストレージチェッカーと外部ディレクトリのキャッシュを破棄"""
+        self._checker_cache = (None, None, 0.0)
+        self._ext_dir_cache = (None, None, 0.0)
 
     def get_backup_type(self):
         """現在のバックアップタイプを取得"""
         return get_backup_type()
 
-    def create_backup(self):
+    def create_backup(self, wait_for_copy=False):
         """
         バックアップを作成
+        外部ストレージへのコピーはバックグラウンドで実行する
+        （wait_for_copy=True の場合はコピー完了まで待機）
         Returns: (success: bool, message: str, backup_path: str or None)
         """
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -64,31 +288,49 @@ class BackupManager:
             os.makedirs(self.backup_dir)
 
         try:
-            # SQLite の安全なバックアップ（backup API を使用）
+            # SQLite の安全なバックアップ（VACUUM INTO / backup API）
             backup_filename = f'{timestamp}_app.db'
-            local_backup_path = os.path.join(self.backup_dir, backup_filename)
 
-            # sqlite3 の backup API を使用
-            source_conn = sqlite3.connect(self.db_path)
-            backup_conn = sqlite3.connect(local_backup_path)
+            # 外部ストレージへ直接書き出せる場合はローカルを経由しない
+            direct_dir = self._get_direct_backup_dir(backup_type)
+            if direct_dir:
+                direct_path = os.path.join(direct_dir, backup_filename)
+                try:
+                    self._write_backup_atomic(direct_path)
+                    write_checksum(direct_path)
+                    drop_page_cache(direct_path, sync=True)
+                except Exception as e:
+                    logger.warning(f"外部ストレージへの直接バックアップ失敗、ローカルに作成: {str(e)}")
+                else:
+                    logger.info(f"外部ストレージへ直接バックアップ作成: {direct_path}")
+                    self.invalidate_listing_cache()
+                    self.invalidate_storage_cache()
+                    self._last_copy_future = None
+                    # ログのコピーはバックグラウンドで
+                    self._copy_pool.submit(bind_app_context(self._copy_logs_to_storage), direct_dir)
+                    self._cleanup_old_backups()
+                    return True, "バックアップ完了", direct_path
 
-            with backup_conn:
-                source_conn.backup(backup_conn)
+            local_backup_path = os.path.join(self.backup_dir, backup_filename)
+            self._write_backup_atomic(local_backup_path)
 
-            source_conn.close()
-            backup_conn.close()
+            # 検証用チェックサムを保存（外部ストレージ側の再ハッシュを不要にする）
+            write_checksum(local_backup_path)
 
             logger.info(f"ローカルバックアップ作成: {local_backup_path}")
+            self.invalidate_listing_cache()
+            self.invalidate_storage_cache()
 
-            # 外部ストレージへのコピー
-            external_backup_path = None
-            checker = self.storage_checker
+            # 外部ストレージへのコピー（バックグラウンド）
+            copy_future = None
+            checker = self._get_storage_checker(backup_type)
 
             if checker.is_connected():
-                if backup_type == 'usb':
-                    external_backup_path = self._copy_to_usb(local_backup_path, backup_filename)
-                else:
-                    external_backup_path = self._copy_to_nas(local_backup_path, backup_filename)
+                copy_future = self._copy_pool.submit(
+                    bind_app_context(self._copy_external),
+                    local_backup_path, backup_filename, backup_type
+                )
+                self._last_copy_future = copy_future
             else:
                 storage_name = 'USB' if backup_type == 'usb' else 'NAS'
                 logger.warning(f"{storage_name}未接続: 外部バックアップをスキップ")
@@ -96,12 +338,127 @@ class BackupManager:
             # 古いバックアップの削除
             self._cleanup_old_backups()
 
-            return True, "バックアップ完了", external_backup_path or local_backup_path
+            if copy_future is not None and wait_for_copy:
+                external_backup_path = copy_future.result()
+                return True, "バックアップ完了", external_backup_path or local_backup_path
+
+            if copy_future is not None:
+                return True, "バックアップ完了（外部ストレージへのコピーを実行中）", local_backup_path
+            return True, "バックアップ完了", local_backup_path
 
         except Exception as e:
             logger.error(f"バックアップ失敗: {str(e)}")
             return False, f"バックアップ失敗: {str(e)}", None
 
+    def _get_direct_backup_dir(self, backup_type):
+        """直接書き出し先の外部ディレクトリを返す（使えない場合は None）"""
+        # NAS はサイズに関係なく直接書き出せる（SMB 上へ VACUUM INTO で1回だけ書く）
+        nas_direct = backup_type == 'nas' and Config.NAS_DIRECT
+        if not (Config.BACKUP_DIRECT_TO_EXTERNAL or nas_direct):
+            return None
+        try:
+            if not nas_direct and os.path.getsize(self.db_path) > Config.BACKUP_DIRECT_MAX_SIZE:
+                return None
+            external_dir = self._get_external_backup_dir(backup_type)
+            if not external_dir:
+                return None
+            os.makedirs(external_dir, exist_ok=True)
+            if not os.access(external_dir, os.W_OK):
+                return None
+            return external_dir
+        except OSError as e:
+            logger.warning(f"外部ストレージ確認失敗: {str(e)}")
+            return None
+
+    def _write_backup_atomic(self, backup_path):
+        """一時ファイルに書き出してから rename で公開する
+        （途中で落ちても不完全な .db が一覧やコピー対象に出ない）"""
+        tmp_path = backup_path + '.tmp'
+        try:
+            self._write_backup_file(tmp_path)
+            os.replace(tmp_path, backup_path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _write_backup_file(self, dest_path):
+        """設定された方式で DB のコピーを dest_path に作成"""
+        if Config.BACKUP_METHOD == 'vacuum':
+            try:
+                self._vacuum_into(dest_path)
+                return
+            except sqlite3.OperationalError as e:
+                # ロック中や VACUUM INTO 非対応の SQLite では backup API で作り直す
+                logger.warning(f"VACUUM INTO 失敗、backup API で再試行: {str(e)}")
+                try:
+                    os.remove(dest_path)
+                except FileNotFoundError:
+                    pass
+        self._write_sqlite_backup(dest_path)
+
+    def _vacuum_into(self, dest_path):
+        """読み取り専用接続から VACUUM INTO で最適化済みのコピーを作成"""
+        source_uri = f'{self.db_path.as_uri()}?mode=ro'
+        conn = sqlite3.connect(source_uri, uri=True, isolation_level=None, cached_statements=0)
+        try:
+            conn.execute('VACUUM INTO ?', (dest_path,))
+        finally:
+            conn.close()
+
+    def _write_sqlite_backup(self, dest_path):
+        """sqlite3 の backup API で DB を dest_path に書き出す"""
+        # 書き出し先の領域を先に確保し、コピー中のファイル拡張を減らす
+        preallocate_db_file(dest_path, os.path.getsize(self.db_path))
+
+        # backup() 専用の接続のため、暗黙トランザクションと文キャッシュは不要
+        conn_options = dict(isolation_level=None, check_same_thread=False, cached_statements=0)
+        source_conn = sqlite3.connect(self.db_path, **conn_options)
+        backup_conn = sqlite3.connect(dest_path, **conn_options)
+        try:
+            # 読み出しは mmap 経由（接続単位の設定のみ。DB の journal_mode は変更しない）
+            source_conn.execute('PRAGMA mmap_size=268435456')  # 256MiB
+            source_conn.execute('PRAGMA cache_size=-65536')  # 64MiB
+
+            # 新規ファイルで失敗時は作り直せばよいため、途中の同期書き込みは省く
+            backup_conn.execute('PRAGMA synchronous=OFF')
+            backup_conn.execute('PRAGMA mmap_size=268435456')
+
+            with backup_conn:
+                # ステップ間のスリープなしでページをまとめてコピー
+                source_conn.backup(
+                    backup_conn,
+                    pages=Config.BACKUP_STEP_PAGES,
+                    progress=None,
+                    sleep=0
+                )
+            # 元 DB が WAL の場合はヘッダーがそのまま複製されるため、単体で開けるよう DELETE モードにする
+            backup_conn.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            source_conn.close()
+            backup_conn.close()
+
+    def _copy_external(self, local_path, filename, backup_type):
+        """外部ストレージ（USB/NAS）にバックアップをコピー"""
+        if backup_type == 'usb':
+            path = self._copy_to_usb(local_path, filename)
+        else:
+            path = self._copy_to_nas(local_path, filename)
+        self.invalidate_listing_cache()
+        return path
+
+    def get_external_copy_status(self):
+        """直近の外部ストレージコピーの状態を取得"""
+        future = self._last_copy_future
+        if future is None:
+            return None
+        if not future.done():
+            return {'status': 'running', 'path': None}
+        path = future.result()
+        return {'status': 'done' if path else 'failed', 'path': path}
+
     def _copy_to_usb(self, local_path, filename):
         """USBにバックアップをコピー"""
         try:
@@ -115,8 +472,13 @@ class BackupManager:
             if not os.path.exists(usb_backup_dir):
                 os.makedirs(usb_backup_dir)
 
-            usb_backup_path = os.path.join(usb_backup_dir, filename)
-            shutil.copy2(local_path, usb_backup_path)
+            # チェックサムは圧縮有無に関わらず .db の内容に対するものを .db.sha256 として置く
+            self._copy_checksum(local_path, os.path.join(usb_backup_dir, filename))
+            usb_backup_path = copy_backup_file(local_path, os.path.join(usb_backup_dir, filename))
+
+            # 再読込されないバックアップデータでページキャッシュを占有しない
+            drop_page_cache(local_path)
+            drop_page_cache(usb_backup_path, sync=True)
 
             # ログファイルもコピー
             self._copy_logs_to_storage(usb_backup_dir)
@@ -137,8 +499,13 @@ class BackupManager:
             if not nas_backup_dir:
                 return None
 
-            nas_backup_path = os.path.join(nas_backup_dir, filename)
-            shutil.copy2(local_path, nas_backup_path)
+            # チェックサムは圧縮有無に関わらず .db の内容に対するものを .db.sha256 として置く
+            self._copy_checksum(local_path, os.path.join(nas_backup_dir, filename))
+            nas_backup_path = copy_backup_file(local_path, os.path.join(nas_backup_dir, filename))
+
+            # 再読込されないバックアップデータでページキャッシュを占有しない
+            drop_page_cache(local_path)
+            drop_page_cache(nas_backup_path, sync=True)
 
             # ログファイルもコピー
             self._copy_logs_to_storage(nas_backup_dir)
@@ -150,148 +517,195 @@ class BackupManager:
             logger.error(f"NASコピー失敗: {str(e)}")
             return None
 
+    def _copy_checksum(self, local_path, dest_path):
+        """チェックサムのサイドカーファイルをコピー"""
+        checksum_path = local_path + CHECKSUM_SUFFIX
+        if os.path.exists(checksum_path):
+            fast_copy(checksum_path, dest_path + CHECKSUM_SUFFIX)
+
     def _copy_logs_to_storage(self, backup_dir):
-        """ログファイルを外部ストレージにコピー"""
+        """ログファイルを外部ストレージに tar でまとめてコピー"""
         try:
-            logs_dir = os.path.join(backup_dir, 'logs')
-            if not os.path.exists(logs_dir):
-                os.makedirs(logs_dir)
-
             source_logs_dir = os.path.dirname(Config.LOG_FILE)
-            if os.path.exists(source_logs_dir):
-                for log_file in os.listdir(source_logs_dir):
-                    if log_file.endswith('.log'):
-                        shutil.copy2(
-                            os.path.join(source_logs_dir, log_file),
-                            os.path.join(logs_dir, log_file)
-                        )
+            if not os.path.exists(source_logs_dir):
+                return
+
+            # ファイルごとのコピーは SMB では往復が多いため、1本の tar ストリームで書き出す
+            tar_path = os.path.join(backup_dir, 'logs.tar')
+            tmp_path = tar_path + '.tmp'
+            with os.scandir(source_logs_dir) as it:
+                log_entries = sorted(
+                    (entry.name, entry.path) for entry in it
+                    if entry.name.endswith('.log') and entry.is_file()
+                )
+            import tarfile
+            with tarfile.open(tmp_path, 'w|', bufsize=COPY_CHUNK_SIZE) as tf:
+                for name, path in log_entries:
+                    tf.add(path, arcname=f'logs/{name}', recursive=False)
+            os.replace(tmp_path, tar_path)
         except Exception as e:
             logger.error(f"ログコピー失敗: {str(e)}")
 
     def _cleanup_old_backups(self):
         """古いバックアップを削除（ローカルのみ、外部ストレージは永久保存）"""
         cutoff_date = datetime.now() - timedelta(days=self.retention_days)
+        # ファイル名と同じ YYYYMMDD_HHMMSS 形式にしておけば文字列比較で済む
+        cutoff_str = cutoff_date.strftime('%Y%m%d_%H%M%S')
 
         # ローカルバックアップのクリーンアップ
-        self._cleanup_directory(self.backup_dir, cutoff_date)
+        self._cleanup_directory(self.backup_dir, cutoff_str)
 
         # 外部ストレージバックアップは削除しない（アーカイブとして永久保存）
 
-    def _cleanup_directory(self, directory, cutoff_date):
+    def _cleanup_directory(self, directory, cutoff_str):
         """指定ディレクトリ内の古いバックアップを削除"""
         try:
-            for filename in os.listdir(directory):
-                if not filename.endswith('.db'):
-                    continue
-
+            # ファイル名（YYYYMMDD_HHMMSS_app.db）は名前順＝日時順のため、
+            # 二分探索で保持期間の境界を求め、それより前だけを削除する
+            with os.scandir(directory) as it:
+                names = sorted(
+                    entry.name for entry in it
+                    if entry.name.endswith('.db') and is_timestamped_name(entry.name)
+                    and entry.is_file()
+                )
+
+            for filename in names[:bisect.bisect_left(names, cutoff_str)]:
                 filepath = os.path.join(directory, filename)
-
-                # ファイル名から日付を抽出（YYYYMMDD_HHMMSS_app.db）
+                os.remove(filepath)
                 try:
-                    date_str = filename[:15]  # YYYYMMDD_HHMMSS
-                    file_date = datetime.strptime(date_str, '%Y%m%d_%H%M%S')
-
-                    if file_date < cutoff_date:
-                        os.remove(filepath)
-                        logger.info(f"古いバックアップを削除: {filename}")
-                except ValueError:
-                    continue
+                    os.remove(filepath + CHECKSUM_SUFFIX)
+                except FileNotFoundError:
+                    pass
+                logger.info(f"古いバックアップを削除: {filename}")
         except Exception as e:
             logger.error(f"クリーンアップ失敗: {str(e)}")
 
-    def _get_external_backup_dir(self):
-        """外部ストレージのバックアップディレクトリを取得"""
-        backup_type = get_backup_type()
+    def _get_external_backup_dir(self, backup_type=None):
+        """外部ストレージのバックアップディレクトリを取得（短時間キャッシュ）"""
+        if backup_type is None:
+            backup_type = get_backup_type()
+        cached_type, cached_dir, expires_at = self._ext_dir_cache
+        if cached_type == backup_type and time.monotonic() < expires_at:
+            return cached_dir
+
+        external_dir = None
         try:
-            if backup_type == 'usb':
-                from usb_check import USBChecker
-                usb_checker = USBChecker()
-                if usb_checker.is_connected():
-                    mount_point = usb_checker.get_mount_point()
+            checker = self._get_storage_checker(backup_type)
+            if checker.is_connected():
+                if backup_type == 'usb':
+                    mount_point = checker.get_mount_point()
                     if mount_point:
-                        return os.path.join(mount_point, Config.USB_BACKUP_FOLDER)
-            else:
-                from nas_check import NASChecker
-                nas_checker = NASChecker()
-                if nas_checker.is_connected():
-                    return nas_checker.get_backup_dir()
+                        external_dir = os.path.join(mount_point, Config.USB_BACKUP_FOLDER)
+                else:
+                    external_dir = checker.get_backup_dir()
         except Exception as e:
             logger.error(f"外部ストレージディレクトリ取得失敗: {str(e)}")
-        return None
+            return None
 
-    def get_last_backup_info(self):
-        """最後のバックアップ情報を取得"""
-        backups = []
+        self._ext_dir_cache = (backup_type, external_dir, time.monotonic() + STORAGE_CHECK_TTL)
+        return external_dir
+
+    def _scan_backup_dir(self, directory, location):
+        """
+        ディレクトリ内のバックアップファイル（.db / .db.zst）を走査
+        結果は BACKUP_LIST_TTL 秒キャッシュし、ディレクトリの mtime が変われば再走査する
+        Returns: list of dict (path, filename, location, size, modified: mtime)
+        """
+        directory = os.fspath(directory)
+        try:
+            dir_mtime = os.stat(directory).st_mtime
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"バックアップ一覧取得失敗: {directory}: {str(e)}")
+            return []
+
+        now = time.monotonic()
+        with self._listing_lock:
+            cached = self._listing_cache.get(directory)
+
+        if cached and cached[0] > now and cached[1] == dir_mtime:
+            entries = cached[2]
+        else:
+            entries = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if not entry.name.endswith(BACKUP_SUFFIXES) or not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        entries.append((entry.path, entry.name, stat.st_size, stat.st_mtime))
+            except Exception as e:
+                logger.error(f"バックアップ一覧取得失敗: {directory}: {str(e)}")
+                return []
+            with self._listing_lock:
+                self._listing_cache[directory] = (now + Config.BACKUP_LIST_TTL, dir_mtime, entries)
+
+        return [
+            {
+                'path': path,
+                'filename': name,
+                'location': location,
+                'size': size,
+                'modified': mtime
+            }
+            for path, name, size, mtime in entries
+        ]
+
+    def invalidate_listing_cache(self):
+        """バックアップ一覧キャッシュを破棄"""
+        with self._listing_lock:
+            self._listing_cache.clear()
+
+    def _scan_all_backups(self):
+        """ローカルと外部ストレージのバックアップを並行して走査"""
         backup_type = get_backup_type()
 
-        # ローカルバックアップを確認
-        if os.path.exists(self.backup_dir):
-            for filename in os.listdir(self.backup_dir):
-                if filename.endswith('.db'):
-                    filepath = os.path.join(self.backup_dir, filename)
-                    backups.append({
-                        'path': filepath,
-                        'filename': filename,
-                        'location': 'local',
-                        'modified': datetime.fromtimestamp(os.path.getmtime(filepath))
-                    })
-
-        # 外部ストレージバックアップを確認
-        external_backup_dir = self._get_external_backup_dir()
-        if external_backup_dir and os.path.exists(external_backup_dir):
-            location = 'usb' if backup_type == 'usb' else 'nas'
-            for filename in os.listdir(external_backup_dir):
-                if filename.endswith('.db'):
-                    filepath = os.path.join(external_backup_dir, filename)
-                    backups.append({
-                        'path': filepath,
-                        'filename': filename,
-                        'location': location,
-                        'modified': datetime.fromtimestamp(os.path.getmtime(filepath))
-                    })
+        # 外部ストレージ側は接続確認も含めて遅いため、ローカルと同時に走査する
+        # （同時刻のファイルは外部ストレージ側を優先するため、外部を先に並べる）
+        futures = [
+            self._scan_pool.submit(bind_app_context(self._scan_external_backups), backup_type),
+            self._scan_pool.submit(self._scan_backup_dir, self.backup_dir, 'local'),
+        ]
+        return [backup for future in futures for backup in future.result()]
+
+    def _scan_external_backups(self, backup_type):
+        """外部ストレージのバックアップを走査"""
+        external_backup_dir = self._get_external_backup_dir(backup_type)
+        if not external_backup_dir:
+            return []
+        location = 'usb' if backup_type == 'usb' else 'nas'
+        return self._scan_backup_dir(external_backup_dir, location)
 
+    def get_last_backup_info(self):
+        """最後のバックアップ情報を取得"""
+        backups = self._scan_all_backups()
         if not backups:
             return None
 
         # 最新のバックアップを返す
-        backups.sort(key=lambda x: x['modified'], reverse=True)
-        latest = backups[0]
-        latest['modified'] = latest['modified'].isoformat()
-        return latest
+        latest = max(backups, key=lambda x: x['modified'])
+        return {
+            'path': latest['path'],
+            'filename': latest['filename'],
+            'location': latest['location'],
+            'modified': datetime.fromtimestamp(latest['modified']).isoformat(),
+            'external_copy': self.get_external_copy_status()
+        }
 
     def list_backups(self):
         """利用可能なバックアップ一覧を取得"""
-        backups = []
-        backup_type = get_backup_type()
-
-        # ローカル
-        if os.path.exists(self.backup_dir):
-            for filename in os.listdir(self.backup_dir):
-                if filename.endswith('.db'):
-                    filepath = os.path.join(self.backup_dir, filename)
-                    backups.append({
-                        'filename': filename,
-                        'location': 'local',
-                        'size': os.path.getsize(filepath),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat()
-                    })
-
-        # 外部ストレージ
-        external_backup_dir = self._get_external_backup_dir()
-        if external_backup_dir and os.path.exists(external_backup_dir):
-            location = 'usb' if backup_type == 'usb' else 'nas'
-            for filename in os.listdir(external_backup_dir):
-                if filename.endswith('.db'):
-                    filepath = os.path.join(external_backup_dir, filename)
-                    backups.append({
-                        'filename': filename,
-                        'location': location,
-                        'size': os.path.getsize(filepath),
-                        'modified': datetime.fromtimestamp(os.path.getmtime(filepath)).isoformat()
-                    })
-
+        backups = self._scan_all_backups()
         backups.sort(key=lambda x: x['modified'], reverse=True)
-        return backups
+        return [
+            {
+                'filename': b['filename'],
+                'location': b['location'],
+                'size': b['size'],
+                'modified': datetime.fromtimestamp(b['modified']).isoformat()
+            }
+            for b in backups
+        ]
 
 
 def check_storage_on_startup():
@@ -2,10 +2,14 @@
 アプリケーション設定
 """
 import os
+import json
 from datetime import timedelta
-from dotenv import load_dotenv
+from functools import partial
 
-load_dotenv()
+# 環境変数が設定済みの実行（cron やテスト）では .env の読み込みを省略できる
+if not os.environ.get('CONFIG_SKIP_DOTENV'):
+    from dotenv import load_dotenv
+    load_dotenv()
 
 
 class Config:
@@ -18,6 +22,8 @@ class Config:
     DATABASE_PATH = os.getenv('DATABASE_PATH', 'data/app.db')
     SQLALCHEMY_DATABASE_URI = f'sqlite:///{os.path.join(BASE_DIR, DATABASE_PATH)}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # JSON 列（監査ログ）は日本語をエスケープせずに保存
+    SQLALCHEMY_ENGINE_OPTIONS = {'json_serializer': partial(json.dumps, ensure_ascii=False)}
 
     # セッション
     PERMANENT_SESSION_LIFETIME = timedelta(hours=8)
@@ -46,6 +52,15 @@ class Config:
     BACKUP_TIME = os.getenv('BACKUP_TIME', '02:00')
     BACKUP_RETENTION_DAYS = int(os.getenv('BACKUP_RETENTION_DAYS', '365'))
     BACKUP_DIR = os.path.join(BASE_DIR, 'backups')
+    BACKUP_STEP_PAGES = int(os.getenv('BACKUP_STEP_PAGES', '1000'))  # backup API 1ステップのページ数
+    BACKUP_LIST_TTL = float(os.getenv('BACKUP_LIST_TTL', '30'))  # バックアップ一覧キャッシュ（秒）
+    BACKUP_METHOD = os.getenv('BACKUP_METHOD', 'vacuum')  # vacuum（VACUUM INTO）/ backup（backup API）
+    # 外部ストレージ接続時はローカルを経由せず直接書き出す（SDカードへの書き込みを削減）
+    BACKUP_DIRECT_TO_EXTERNAL = os.getenv('BACKUP_DIRECT_TO_EXTERNAL', 'False').lower() == 'true'
+    BACKUP_DIRECT_MAX_SIZE = int(os.getenv('BACKUP_DIRECT_MAX_SIZE', '104857600'))  # 100MB
+    # NAS 利用時はサイズ上限なしで NAS 上に直接書き出す
+    NAS_DIRECT = os.getenv('NAS_DIRECT', 'False').lower() == 'true'
+    BACKUP_COMPRESS = os.getenv('BACKUP_COMPRESS', '')  # zstd: 外部コピーを圧縮（要 zstandard）
 
     # 返却期限
     DEFAULT_RETURN_DAYS = int(os.getenv('DEFAULT_RETURN_DAYS', '14'))
@@ -2,11 +2,27 @@
 ロギング設定
 """
 import os
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from pathlib import Path
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from config import Config
 
 
+def _start_queue_listener(logger, *handlers):
+    """ハンドラを QueueListener 経由で logger に接続し、リスナーを返す"""
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # 終了時に残りのレコードを書き出す
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
+    return listener
+
+
 def setup_logger(app):
     """アプリケーションのロガーを設定"""
     # ログディレクトリの作成
@@ -33,31 +49,50 @@ def setup_logger(app):
         '%(asctime)s - %(levelname)s - %(message)s'
     ))
 
-    # アプリロガーに追加
-    app.logger.addHandler(file_handler)
-    app.logger.addHandler(console_handler)
+    # 書き込みは別スレッドで行い、リクエスト処理側はキューに積むだけにする
+    listener = _start_queue_listener(app.logger, file_handler, console_handler)
+    app.extensions['log_listener'] = listener
     app.logger.setLevel(logging.DEBUG if Config.DEBUG else logging.INFO)
 
     return app.logger
 
 
+# 監査ログのパス（logs/app.log -> logs/app_audit.log）はインポート時に一度だけ求める
+_LOG_FILE_PATH = Path(Config.LOG_FILE)
+_AUDIT_LOG_PATH = str(_LOG_FILE_PATH.with_name(_LOG_FILE_PATH.stem + '_audit.log'))
+_AUDIT_LOGGER = None
+_audit_logger_lock = threading.Lock()
+
+
 def get_audit_logger():
-    """監査ログ専用のロガーを取得"""
-    logger = logging.getLogger('audit')
+    """監査ログ専用のロガーを取得（初回呼び出し時に一度だけ設定）"""
+    global _AUDIT_LOGGER
+    if _AUDIT_LOGGER is not None:
+        return _AUDIT_LOGGER
+
+    with _audit_logger_lock:
+        if _AUDIT_LOGGER is not None:
+            return _AUDIT_LOGGER
 
-    if not logger.handlers:
+        logger = logging.getLogger('audit')
         # 監査ログ専用ファイル
-        audit_log_path = Config.LOG_FILE.replace('.log', '_audit.log')
         handler = RotatingFileHandler(
-            audit_log_path,
+            _AUDIT_LOG_PATH,
             maxBytes=Config.LOG_MAX_SIZE,
             backupCount=Config.LOG_BACKUP_COUNT,
             encoding='utf-8'
         )
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s - AUDIT - %(message)s'
-        ))
-        logger.addHandler(handler)
+        # 日時は UTC（gmtime はタイムゾーン/DST の解決が不要で軽い）
+        formatter = logging.Formatter(
+            '%(asctime)s - AUDIT - %(message)s',
+            datefmt='%Y-%m-%dT%H:%M:%SZ'
+        )
+        formatter.converter = time.gmtime
+        handler.setFormatter(formatter)
+        _start_queue_listener(logger, handler)
         logger.setLevel(logging.INFO)
+        # ルートロガーへ伝播させず、二重に整形・出力しない
+        logger.propagate = False
 
-    return logger
+        _AUDIT_LOGGER = logger
+        return logger
@@ -18,12 +18,11 @@ def migrate():
     print(f"データベース: {db_path}")
 
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        # トランザクションは BEGIN IMMEDIATE / COMMIT で明示的に管理する
+        conn = sqlite3.connect(db_path, isolation_level=None)
 
         # patient_id列が既に存在するか確認
-        cursor.execute("PRAGMA table_info(item_logs)")
-        columns = [column[1] for column in cursor.fetchall()]
+        columns = [column[1] for column in conn.execute("PRAGMA table_info(item_logs)")]
 
         if 'patient_id' in columns:
             print("✓ patient_id列は既に存在します。マイグレーション不要です。")
@@ -32,39 +31,45 @@ def migrate():
 
         print("patient_id列を追加しています...")
 
+        # インデックス作成のソートはメモリ上で行う（接続単位の設定のみ）
+        conn.execute("PRAGMA cache_size=-262144")  # 256MiB
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+        # 列追加とインデックス作成を1トランザクションで実行
+        conn.execute("BEGIN IMMEDIATE")
+
         # patient_id列を追加
-        cursor.execute("""
+        conn.execute("""
             ALTER TABLE item_logs
             ADD COLUMN patient_id TEXT
         """)
 
         # インデックスを作成
-        cursor.execute("""
+        conn.execute("""
             CREATE INDEX IF NOT EXISTS ix_item_logs_patient_id
             ON item_logs (patient_id)
         """)
 
-        conn.commit()
-        print("✓ patient_id列とインデックスを追加しました")
-
-        # 確認
-        cursor.execute("PRAGMA table_info(item_logs)")
-        columns = [column[1] for column in cursor.fetchall()]
+        # 確認（コミット前に検証し、失敗時はまとめて取り消す）
+        columns = [column[1] for column in conn.execute("PRAGMA table_info(item_logs)")]
 
         if 'patient_id' in columns:
+            conn.execute("COMMIT")
+            print("✓ patient_id列とインデックスを追加しました")
             print("✓ マイグレーション成功")
             conn.close()
             return True
         else:
             print("✗ マイグレーション失敗: patient_id列が見つかりません")
-            conn.rollback()
+            conn.execute("ROLLBACK")
             conn.close()
             return False
 
     except Exception as e:
         print(f"✗ エラーが発生しました: {e}")
         if 'conn' in locals():
-            conn.rollback()
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
             conn.close()
         return False
 
@@ -1,12 +1,77 @@
 """
 データベースモデル
 """
+import hmac
+import hashlib
+import secrets
+import time
 from datetime import datetime, timedelta
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Integer, and_, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.sql.functions import FunctionElement
+from sqlalchemy.orm import raiseload, selectinload
 from werkzeug.security import generate_password_hash, check_password_hash
+from config import Config
 
 db = SQLAlchemy()
 
+# パスワード検証結果のキャッシュ（PBKDF2 の再計算を省く）
+# キーはプロセス固有の鍵による HMAC なので平文・ハッシュ値はメモリに残らない
+_PASSWORD_CACHE = {}
+_PASSWORD_CACHE_TTL = 60.0
+_PASSWORD_CACHE_MAX = 256
+_PASSWORD_CACHE_KEY = secrets.token_bytes(32)
+
+# AppSettings.get_prefixed のキャッシュ: 'nas_host' などの設定キー -> (取得時刻, 値)
+_SETTINGS_CACHE = {}
+_SETTINGS_CACHE_TTL = 30.0
+
+
+def _password_cache_key(password_hash, password):
+    msg = f'{password_hash}\0{password}'.encode('utf-8')
+    return hmac.new(_PASSWORD_CACHE_KEY, msg, hashlib.sha256).digest()
+
+
+class days_between(FunctionElement):
+    """days_between(start, end): end - start の日数（timedelta.days と同じく負の方向へ切り捨て）"""
+    type = Integer()
+    name = 'days_between'
+    inherit_cache = True
+
+
+@compiles(days_between, 'sqlite')
+def _days_between_sqlite(element, compiler, **kw):
+    start, end = [compiler.process(c, **kw) for c in element.clauses]
+    diff = f'(julianday({end}) - julianday({start}))'
+    # CAST は 0 方向への切り捨てのため、負の端数は 1 を引いて補正
+    return f'(CAST({diff} AS INTEGER) - ({diff} < CAST({diff} AS INTEGER)))'
+
+
+@compiles(days_between, 'postgresql')
+def _days_between_postgresql(element, compiler, **kw):
+    start, end = [compiler.process(c, **kw) for c in element.clauses]
+    return f'CAST(floor(EXTRACT(EPOCH FROM ({end} - {start})) / 86400) AS INTEGER)'
+
+
+def _isoformat(dt):
+    """datetime を ISO 8601 に変換（None はそのまま）"""
+    return dt.isoformat() if dt else None
+
+
+def _iso_z(dt):
+    """naive UTC の datetime を ISO 8601（末尾 Z）に変換
+    （isoformat() + 'Z' と同じ出力。マイクロ秒が 0 の場合は省略）"""
+    if dt is None:
+        return None
+    if dt.microsecond:
+        return (f'{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T'
+                f'{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}.{dt.microsecond:06d}Z')
+    return (f'{dt.year:04d}-{dt.month:02d}-{dt.day:02d}T'
+            f'{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}Z')
+
 
 class User(db.Model):
     """ユーザー（操作者）"""
@@ -25,6 +90,7 @@ class User(db.Model):
 
     def set_password(self, password):
         """パスワードをハッシュ化して保存"""
+        _PASSWORD_CACHE.clear()
         if password:
             self.password_hash = generate_password_hash(password)
         else:
@@ -34,22 +100,25 @@ class User(db.Model):
         """パスワードを検証"""
         if not self.password_hash:
             return True  # パスワード未設定の場合は常にOK
-        return check_password_hash(self.password_hash, password)
+        # 成功した検証のみ短時間キャッシュ（失敗はキャッシュしない）
+        key = _password_cache_key(self.password_hash, password)
+        now = time.monotonic()
+        expires = _PASSWORD_CACHE.get(key)
+        if expires is not None and expires > now:
+            return True
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if len(_PASSWORD_CACHE) >= _PASSWORD_CACHE_MAX:
+            _PASSWORD_CACHE.clear()
+        _PASSWORD_CACHE[key] = now + _PASSWORD_CACHE_TTL
+        return True
 
     @property
     def has_password(self):
         """パスワードが設定されているか"""
         return self.password_hash is not None
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'is_admin': self.is_admin,
-            'has_password': self.has_password,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'is_active': self.is_active
-        }
+    # to_dict はモジュール末尾の _compile_to_dict で生成
 
 
 class ItemLog(db.Model):
@@ -61,6 +130,7 @@ class ItemLog(db.Model):
     patient_id = db.Column(db.String(100), nullable=True, index=True)  # 患者ID
     quantity = db.Column(db.Integer, default=1)
     scanned_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    scanned_by_name = db.Column(db.String(100), nullable=True)  # スキャン者名（一覧表示用に保持）
     scanned_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     expected_return_date = db.Column(db.DateTime, nullable=True, index=True)
     preliminary_report = db.Column(db.Boolean, default=False, index=True)  # 仮報告済み
@@ -71,7 +141,7 @@ class ItemLog(db.Model):
     block_returned_at = db.Column(db.DateTime, nullable=True)  # ブロック返却日時
     slide_quantity = db.Column(db.Integer, default=0)  # スライド返却個数
     slide_returned_at = db.Column(db.DateTime, nullable=True)  # スライド返却日時
-    completed = db.Column(db.Boolean, default=False, index=True)  # 完了フラグ（完了ボタン押下）
+    completed = db.Column(db.Boolean, default=False)  # 完了フラグ（完了ボタン押下）
     completed_at = db.Column(db.DateTime, nullable=True)  # 完了日時
     notes = db.Column(db.Text, nullable=True)
     deleted_at = db.Column(db.DateTime, nullable=True, index=True)
@@ -96,53 +166,69 @@ class ItemLog(db.Model):
         db.Index('ix_barcode_scannedat', 'barcode', 'scanned_at'),
         db.Index('ix_returned_deleted', 'returned', 'deleted_at'),
         db.Index('ix_completed_deleted', 'completed', 'deleted_at'),
+        # 一覧（未削除・未完了を新しい順）用。completed 単独のインデックスは選択性が低いため使わない
+        db.Index(
+            'ix_open_scan', 'scanned_at',
+            sqlite_where=text('deleted_at IS NULL AND completed = 0'),
+            postgresql_where=text('deleted_at IS NULL AND completed = false')
+        ),
+        db.Index(
+            'ix_patient_open', 'patient_id', 'scanned_at',
+            sqlite_where=text('deleted_at IS NULL'),
+            postgresql_where=text('deleted_at IS NULL')
+        ),
     )
 
-    @property
+    @hybrid_property
     def is_overdue(self):
         """期限超過かどうか"""
+        return self._is_overdue_at(datetime.utcnow())
+
+    @is_overdue.expression
+    def is_overdue(cls):
+        """期限超過の SQL 条件（ItemLog.query.filter(ItemLog.is_overdue) で使用）"""
+        return and_(
+            cls.returned == False,
+            cls.deleted_at == None,
+            cls.expected_return_date != None,
+            cls.expected_return_date < datetime.utcnow()
+        )
+
+    @hybrid_property
+    def days_until_due(self):
+        """返却期限までの日数（負の場合は超過日数）"""
+        return self._days_until_due_at(datetime.utcnow())
+
+    @days_until_due.expression
+    def days_until_due(cls):
+        """返却期限までの日数の SQL 式（SQLite / PostgreSQL 対応）"""
+        return days_between(datetime.utcnow(), cls.expected_return_date)
+
+    def _is_overdue_at(self, now):
+        """now 時点で期限超過かどうか"""
         if self.returned or self.deleted_at:
             return False
         if not self.expected_return_date:
             return False
-        return datetime.utcnow() > self.expected_return_date
+        return now > self.expected_return_date
 
-    @property
-    def days_until_due(self):
-        """返却期限までの日数（負の場合は超過日数）"""
+    def _days_until_due_at(self, now):
+        """now 時点での返却期限までの日数"""
         if not self.expected_return_date:
             return None
-        delta = self.expected_return_date - datetime.utcnow()
+        delta = self.expected_return_date - now
         return delta.days
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'barcode': self.barcode,
-            'patient_id': self.patient_id,
-            'quantity': self.quantity,
-            'scanned_by_id': self.scanned_by_id,
-            'scanned_by_name': self.scanned_by.name if self.scanned_by else None,
-            'scanned_at': self.scanned_at.isoformat() + 'Z' if self.scanned_at else None,
-            'expected_return_date': self.expected_return_date.isoformat() + 'Z' if self.expected_return_date else None,
-            'preliminary_report': self.preliminary_report,
-            'preliminary_report_at': self.preliminary_report_at.isoformat() + 'Z' if self.preliminary_report_at else None,
-            'returned': self.returned,
-            'returned_at': self.returned_at.isoformat() + 'Z' if self.returned_at else None,
-            'block_quantity': self.block_quantity,
-            'block_returned': self.block_returned,
-            'block_returned_at': self.block_returned_at.isoformat() + 'Z' if self.block_returned_at else None,
-            'slide_quantity': self.slide_quantity,
-            'slide_returned': self.slide_returned,
-            'slide_returned_at': self.slide_returned_at.isoformat() + 'Z' if self.slide_returned_at else None,
-            'completed': self.completed,
-            'completed_at': self.completed_at.isoformat() + 'Z' if self.completed_at else None,
-            'all_returned': self.all_returned,
-            'notes': self.notes,
-            'deleted_at': self.deleted_at.isoformat() + 'Z' if self.deleted_at else None,
-            'is_overdue': self.is_overdue,
-            'days_until_due': self.days_until_due
-        }
+    @classmethod
+    def query_for_list(cls):
+        """一覧用クエリ（スキャン者名は列に保持しているため結合不要。遅延ロードは例外にして N+1 を防ぐ）"""
+        return cls.query.options(raiseload('*'))
+
+    # to_dict はモジュール末尾の _compile_to_dict で生成
+
+
+# 監査ログの変更前後の値（None は JSON の null ではなく SQL NULL として保存）
+JSON_VALUE = db.JSON(none_as_null=True).with_variant(postgresql.JSONB(none_as_null=True), 'postgresql')
 
 
 class AuditLog(db.Model):
@@ -155,25 +241,22 @@ class AuditLog(db.Model):
     record_id = db.Column(db.Integer, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
-    old_value = db.Column(db.Text, nullable=True)
-    new_value = db.Column(db.Text, nullable=True)
+    # JSON として保存（PostgreSQL では JSONB）。既存の JSON 文字列の行もそのまま読める
+    old_value = db.Column(JSON_VALUE, nullable=True)
+    new_value = db.Column(JSON_VALUE, nullable=True)
 
     __table_args__ = (
         db.Index('ix_audit_table_record', 'table_name', 'record_id'),
+        # 変更内容の検索用（GIN は PostgreSQL のみ）
+        db.Index('ix_audit_new_value_gin', 'new_value', postgresql_using='gin').ddl_if(dialect='postgresql'),
     )
 
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'action': self.action,
-            'table_name': self.table_name,
-            'record_id': self.record_id,
-            'user_id': self.user_id,
-            'user_name': self.user.name if self.user else None,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
-            'old_value': self.old_value,
-            'new_value': self.new_value
-        }
+    @classmethod
+    def query_for_list(cls):
+        """一覧用クエリ（ユーザーを一括取得し、それ以外の遅延ロードは例外にして N+1 を防ぐ）"""
+        return cls.query.options(selectinload(cls.user), raiseload('*'))
+
+    # to_dict はモジュール末尾の _compile_to_dict で生成
 
 
 class AppSettings(db.Model):
@@ -191,14 +274,130 @@ class AppSettings(db.Model):
         setting = cls.query.filter_by(key=key).first()
         return setting.value if setting else default
 
+    @classmethod
+    def get_many(cls, keys):
+        """複数の設定値を1回のクエリで取得（存在するキーのみ）"""
+        rows = cls.query.filter(cls.key.in_(keys)).all()
+        return {setting.key: setting.value for setting in rows}
+
+    @classmethod
+    def get_prefixed(cls, prefix, defaults):
+        """
+        接頭辞付きの設定（nas_ / usb_）をまとめて取得（AppSettings優先、フォールバック: Config → defaults）
+        キャッシュにない設定は1回の IN クエリで読み込み、_SETTINGS_CACHE_TTL 秒保持する
+        defaults: {key: default}（key は接頭辞を除いた名前）
+        Returns: {key: value}
+        """
+        from flask import has_app_context
+
+        values = {}
+        if has_app_context():
+            now = time.monotonic()
+            missing = []
+            for key in defaults:
+                cached = _SETTINGS_CACHE.get(prefix + key)
+                if cached and now - cached[0] < _SETTINGS_CACHE_TTL:
+                    values[key] = cached[1]
+                else:
+                    missing.append(prefix + key)
+            if missing:
+                fetched = cls.get_many(missing)
+                for setting_key in missing:
+                    value = fetched.get(setting_key)
+                    _SETTINGS_CACHE[setting_key] = (now, value)
+                    values[setting_key[len(prefix):]] = value
+
+        result = {}
+        for key, default in defaults.items():
+            value = values.get(key)
+            if value is None or value == '':
+                # Config からフォールバック（例: nas_host → Config.NAS_HOST）
+                value = getattr(Config, (prefix + key).upper(), default)
+            result[key] = value
+        return result
+
     @classmethod
     def set(cls, key, value):
-        """設定値を保存"""
-        setting = cls.query.filter_by(key=key).first()
-        if setting:
-            setting.value = value
+        """設定値を保存（INSERT ... ON CONFLICT DO UPDATE の1文で登録・更新）"""
+        dialect = db.session.get_bind().dialect.name
+        insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(dialect)
+        if insert is None:
+            setting = cls.query.filter_by(key=key).first()
+            if setting:
+                setting.value = value
+            else:
+                db.session.add(cls(key=key, value=value))
         else:
-            setting = cls(key=key, value=value)
-            db.session.add(setting)
+            now = datetime.utcnow()
+            stmt = insert(cls).values(key=key, value=value, updated_at=now)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[cls.key],
+                set_={'value': stmt.excluded.value, 'updated_at': now}
+            )
+            db.session.execute(stmt)
         db.session.commit()
-        return setting
+
+        # get_prefixed のキャッシュを即時に無効化
+        _SETTINGS_CACHE.pop(key, None)
+
+
+# ============================================================
+# to_dict の生成
+# ============================================================
+
+def _compile_to_dict(model, fields, doc, params='', prologue='', datetime_func='_iso_z'):
+    """to_dict をコード生成してモデルに設定
+
+    列の型に応じた変換式を生成時に決めておき、呼び出し時はフィールドを順に読むだけにする。
+    fields: 列名、または (キー, 式) のタプルのリスト（出力はこの順）
+    """
+    columns = model.__table__.columns
+    lines = [f"def to_dict(self{', ' + params if params else ''}):"]
+    if prologue:
+        lines.append(f'    {prologue}')
+    lines.append('    return {')
+    for field in fields:
+        if isinstance(field, tuple):
+            key, expr = field
+        elif isinstance(columns[field].type, db.DateTime):
+            key, expr = field, f'{datetime_func}(self.{field})'
+        else:
+            key, expr = field, f'self.{field}'
+        lines.append(f'        {key!r}: {expr},')
+    lines.append('    }')
+
+    namespace = {}
+    exec('\n'.join(lines), {'_iso_z': _iso_z, '_isoformat': _isoformat, 'datetime': datetime}, namespace)
+    to_dict = namespace['to_dict']
+    to_dict.__doc__ = doc
+    to_dict.__qualname__ = f'{model.__name__}.to_dict'
+    to_dict.__module__ = __name__
+    model.to_dict = to_dict
+
+
+_compile_to_dict(User, [
+    'id', 'name', 'is_admin',
+    ('has_password', 'self.password_hash is not None'),
+    'created_at', 'is_active',
+], doc='辞書に変換', datetime_func='_isoformat')
+
+_compile_to_dict(ItemLog, [
+    'id', 'barcode', 'patient_id', 'quantity', 'scanned_by_id', 'scanned_by_name',
+    'scanned_at', 'expected_return_date',
+    'preliminary_report', 'preliminary_report_at',
+    'returned', 'returned_at',
+    'block_quantity', ('block_returned', 'self.block_returned'), 'block_returned_at',
+    'slide_quantity', ('slide_returned', 'self.slide_returned'), 'slide_returned_at',
+    'completed', 'completed_at',
+    ('all_returned', 'self.all_returned'),
+    'notes', 'deleted_at',
+    ('is_overdue', 'self._is_overdue_at(now)'),
+    ('days_until_due', 'self._days_until_due_at(now)'),
+], doc='辞書に変換（一覧では同じ now を渡して utcnow() の呼び出しを1回にする）',
+    params='now=None', prologue='if now is None: now = datetime.utcnow()')
+
+_compile_to_dict(AuditLog, [
+    'id', 'action', 'table_name', 'record_id', 'user_id',
+    ('user_name', 'self.user.name if self.user else None'),
+    'timestamp', 'old_value', 'new_value',
+], doc='辞書に変換', datetime_func='_isoformat')
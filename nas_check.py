@@ -4,61 +4,151 @@ Linux Mint / Ubuntu 対応
 Buffalo NAS 直結運用対応（SMB1）
 """
 import os
+import re
+import socket
 import subprocess
 import platform
 import logging
 import hashlib
+import time
 from datetime import datetime
-from config import Config
 
 logger = logging.getLogger(__name__)
 
+# 診断結果に表示する OS 名
+_SYSTEM = platform.system()
+
+
+# マウント状態のキャッシュ有効期間（秒）
+_MOUNT_TTL = 2.0
+
+
+def get_nas_settings(defaults):
+    """
+    複数のNAS設定をまとめて取得（AppSettings優先、フォールバック: Config → defaults）
+    defaults: {key: default}（key は 'nas_' を除いた名前）
+    Returns: {key: value}
+    """
+    from models import AppSettings
+    return AppSettings.get_prefixed('nas_', defaults)
+
 
 def get_nas_setting(key, default=None):
     """AppSettingsからNAS設定を取得（フォールバック: Config）"""
-    try:
-        from flask import has_app_context
-        if has_app_context():
-            from models import AppSettings
-            value = AppSettings.get(f'nas_{key}')
-            if value is not None and value != '':
-                return value
-    except (RuntimeError, ImportError):
-        # Flaskコンテキスト外
-        pass
-
-    # Config からフォールバック
-    config_key = f'NAS_{key.upper()}'
-    return getattr(Config, config_key, default)
+    return get_nas_settings({key: default})[key]
+
+
+# SMB ポート: 445（SMB over TCP）、139（NetBIOS。SMB1 のみの古い NAS 用）
+SMB_PORTS = (445, 139)
+
+
+def probe_smb_port(host, timeout=1.0):
+    """ホストの SMB ポートに TCP 接続できるか確認（ping のプロセス起動を避ける）"""
+    for port in SMB_PORTS:
+        try:
+            socket.create_connection((host, port), timeout=timeout).close()
+            return True
+        except OSError:
+            continue
+    return False
+
+
+# マウント時に試す SMB バージョン（新しい順。Buffalo NAS直結の場合SMB1が必要な場合あり）
+SMB_VERSIONS = ['3.0', '2.1', '2.0', '1.0']
+# 1バージョンあたりのマウントタイムアウト（秒）
+MOUNT_TIMEOUT = 5
+
+# バージョンを変えても結果が変わらないマウントエラー（共有名の誤り・sudo にパスワードが必要）
+# Permission denied（error(13)）は SMB1 やゲスト認証だけ拒否される場合があるため含めない
+_FATAL_MOUNT_ERRORS = (
+    'error(2):',
+    'a password is required',
+    'a terminal is required',
+)
+
+
+def is_fatal_mount_error(stderr):
+    """他の SMB バージョンを試しても無駄なエラーか判定"""
+    return any(marker in stderr for marker in _FATAL_MOUNT_ERRORS)
+
+
+def file_hexdigest(file_path, algorithm):
+    """ファイルのハッシュを計算（Python 3.11+ は hashlib.file_digest の C 実装を使用）"""
+    with open(file_path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):
+            return hashlib.file_digest(f, algorithm).hexdigest()
+        digest = hashlib.new(algorithm)
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+# smbclient -L の共有一覧の行（"	share名   Disk   コメント"）
+_SHARE_RE = re.compile(r'[ \t]+(\S.*?)[ \t]+(Disk|IPC|Printer)\b')
+
+
+def parse_smb_shares(output):
+    """smbclient -L の出力から共有一覧を取得
+    Sharename ヘッダーから最初の空行（または Reconnecting）までの共有表だけを読む
+    Returns: list of dict (name, type)
+    """
+    shares = []
+    in_share_section = False
+    for line in output.split('\n'):
+        if not in_share_section:
+            in_share_section = 'Sharename' in line and 'Type' in line
+            continue
+        if line.strip() == '' or 'Reconnecting' in line:
+            break
+        m = _SHARE_RE.match(line)
+        if m:
+            shares.append({'name': m.group(1), 'type': m.group(2)})
+    return shares
 
 
 class NASChecker:
     """NAS（SMB/CIFS）の接続状態を確認・管理"""
 
     def __init__(self):
-        self.system = platform.system()
-        # AppSettings優先で設定を読み込み
-        self.host = get_nas_setting('host', '')
-        self.share = get_nas_setting('share', '')
-        self.username = get_nas_setting('username', '')
-        self.password = get_nas_setting('password', '')
-        self.mount_point = get_nas_setting('mount_point', '/mnt/nas_backup')
-        required_val = get_nas_setting('required', 'true')
-        self.required = str(required_val).lower() == 'true'
-        self.backup_folder = get_nas_setting('backup_folder', 'barcode_app_backups')
+        self.system = _SYSTEM
+        # AppSettings優先で設定を読み込み（1クエリでまとめて取得）
+        settings = get_nas_settings({
+            'host': '',
+            'share': '',
+            'username': '',
+            'password': '',
+            'mount_point': '/mnt/nas_backup',
+            'required': 'true',
+            'backup_folder': 'barcode_app_backups',
+        })
+        self.host = settings['host']
+        self.share = settings['share']
+        self.username = settings['username']
+        self.password = settings['password']
+        self.mount_point = settings['mount_point']
+        self.required = str(settings['required']).lower() == 'true'
+        self.backup_folder = settings['backup_folder']
+        # is_connected() の結果キャッシュ: (確認時刻, 接続状態)
+        self._mount_cache = None
 
     def is_connected(self):
-        """NASがマウントされているか確認"""
+        """NASがマウントされているか確認（結果は _MOUNT_TTL 秒キャッシュ）"""
         if not self.host:
             # ホストが設定されていない場合は開発モード
             return False
 
-        # マウントポイントが存在し、マウントされているか確認
-        if os.path.ismount(self.mount_point):
-            return True
+        if self._mount_cache and time.monotonic() - self._mount_cache[0] < _MOUNT_TTL:
+            return self._mount_cache[1]
 
+        # マウントポイントが存在し、マウントされているか確認
         # マウントされていない場合、自動マウントを試行
-        return self._try_mount()
+        connected = os.path.ismount(self.mount_point) or self._try_mount()
+        self._mount_cache = (time.monotonic(), connected)
+        return connected
+
+    def invalidate_mount_cache(self):
+        """マウント状態のキャッシュを破棄"""
+        self._mount_cache = None
 
     def is_nas_valid(self):
         """NASが有効で書き込み可能か検証"""
@@ -96,24 +186,27 @@ class NASChecker:
                 credentials = "guest,uid=1000,gid=1000"
 
             # SMBバージョンを順番に試行（Buffalo NAS直結の場合SMB1が必要な場合あり）
-            smb_versions = ['1.0', '2.0', '2.1', '3.0']
-
-            for vers in smb_versions:
+            for vers in SMB_VERSIONS:
                 mount_options = f"{credentials},iocharset=utf8,vers={vers}"
 
                 result = subprocess.run(
                     ['sudo', 'mount', '-t', 'cifs', smb_path, self.mount_point,
                      '-o', mount_options],
-                    capture_output=True,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
                     text=True,
-                    timeout=10
+                    timeout=MOUNT_TIMEOUT
                 )
 
                 if result.returncode == 0:
                     logger.info(f"NASマウント成功 (SMB {vers}): {smb_path} -> {self.mount_point}")
+                    self.invalidate_mount_cache()
                     return True
                 else:
                     logger.debug(f"SMB {vers} 失敗: {result.stderr}")
+                    if is_fatal_mount_error(result.stderr):
+                        logger.warning(f"NASマウント失敗: {result.stderr.strip()}")
+                        return False
 
             logger.warning(f"NASマウント失敗（全バージョン試行済み）")
             return False
@@ -130,22 +223,26 @@ class NASChecker:
         try:
             result = subprocess.run(
                 ['mount', self.mount_point],
-                capture_output=True,
-                text=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
                 timeout=10
             )
-            return result.returncode == 0
+            if result.returncode == 0:
+                self.invalidate_mount_cache()
+                return True
+            return False
         except Exception:
             return False
 
     def unmount(self):
         """NASをアンマウント"""
+        self.invalidate_mount_cache()
         try:
             if os.path.ismount(self.mount_point):
                 result = subprocess.run(
                     ['sudo', 'umount', self.mount_point],
-                    capture_output=True,
-                    text=True
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
                 )
                 return result.returncode == 0
             return True
@@ -185,19 +282,10 @@ class NASChecker:
         }
 
     def check_nas_reachable(self):
-        """NASにネットワーク的に到達可能か確認"""
+        """NASにネットワーク的に到達可能か確認（SMBポートへの TCP 接続）"""
         if not self.host:
             return False
-        try:
-            result = subprocess.run(
-                ['ping', '-c', '1', '-W', '2', self.host],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            return result.returncode == 0
-        except Exception:
-            return False
+        return probe_smb_port(self.host)
 
     def get_nas_info(self):
         """NASの共有情報を取得（smbclient / SMB1対応）"""
@@ -241,22 +329,7 @@ class NASChecker:
 
     def _parse_shares(self, output):
         """smbclient出力から共有一覧をパース"""
-        shares = []
-        in_share_section = False
-        for line in output.split('\n'):
-            if 'Sharename' in line and 'Type' in line:
-                in_share_section = True
-                continue
-            if in_share_section:
-                if line.strip() == '' or 'Reconnecting' in line:
-                    break
-                parts = line.split()
-                if len(parts) >= 2:
-                    shares.append({
-                        'name': parts[0],
-                        'type': parts[1]
-                    })
-        return shares
+        return parse_smb_shares(output)
 
     def verify_backup(self, local_file_path, remote_file_path):
         """バックアップファイルの整合性を検証"""
@@ -267,19 +340,25 @@ class NASChecker:
             if not os.path.exists(remote_file_path):
                 return {'success': False, 'error': 'リモートファイルが存在しません'}
 
-            # ファイルサイズ比較
+            # ファイルサイズ比較（zstd 圧縮されたリモートはサイズが異なるため比較しない）
+            from backup import read_checksum, calculate_backup_sha256, ZSTD_SUFFIX
+            compressed = remote_file_path.endswith(ZSTD_SUFFIX)
             local_size = os.path.getsize(local_file_path)
             remote_size = os.path.getsize(remote_file_path)
 
-            if local_size != remote_size:
+            if not compressed and local_size != remote_size:
                 return {
                     'success': False,
                     'error': f'ファイルサイズ不一致: ローカル={local_size}, リモート={remote_size}'
                 }
 
-            # MD5ハッシュ比較
-            local_hash = self._calculate_md5(local_file_path)
-            remote_hash = self._calculate_md5(remote_file_path)
+            # ハッシュ比較
+            # ローカル側はバックアップ作成時のサイドカー（SHA-256）があれば再計算しない
+            local_hash = read_checksum(local_file_path) or self._calculate_hash(local_file_path)
+            if compressed:
+                remote_hash = calculate_backup_sha256(remote_file_path)
+            else:
+                remote_hash = self._calculate_hash(remote_file_path)
 
             if local_hash != remote_hash:
                 return {
@@ -298,13 +377,10 @@ class NASChecker:
         except Exception as e:
             return {'success': False, 'error': str(e)}
 
-    def _calculate_md5(self, file_path):
-        """ファイルのMD5ハッシュを計算"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+    def _calculate_hash(self, file_path):
+        """ファイルの検証用ハッシュ（SHA-256）を計算
+        （OpenSSL の SHA 拡張命令が使えるため MD5 より速く、サイドカーとも比較できる）"""
+        return file_hexdigest(file_path, 'sha256')
 
     def get_backup_files(self):
         """NAS上のバックアップファイル一覧を取得"""
@@ -312,18 +388,21 @@ class NASChecker:
         if not backup_dir:
             return []
 
+        from backup import BACKUP_SUFFIXES
+
         files = []
         try:
-            for filename in os.listdir(backup_dir):
-                if filename.endswith('.db'):
-                    filepath = os.path.join(backup_dir, filename)
-                    stat = os.stat(filepath)
-                    files.append({
-                        'filename': filename,
-                        'path': filepath,
-                        'size': stat.st_size,
-                        'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
-                    })
+            # scandir のエントリを使い、CIFS 上でのパス組み立てと追加の stat を減らす
+            with os.scandir(backup_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(BACKUP_SUFFIXES) and entry.is_file():
+                        stat = entry.stat()
+                        files.append({
+                            'filename': entry.name,
+                            'path': entry.path,
+                            'size': stat.st_size,
+                            'modified': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                        })
             files.sort(key=lambda x: x['modified'], reverse=True)
         except Exception as e:
             logger.error(f"バックアップファイル一覧取得失敗: {e}")
@@ -351,24 +430,16 @@ class NASChecker:
         # 2. ネットワーク到達性
         reachable = self.check_nas_reachable()
         results['tests'].append({
-            'name': 'ネットワーク到達性 (ping)',
+            'name': 'ネットワーク到達性 (SMBポート)',
             'status': 'ok' if reachable else 'error',
-            'detail': f'{self.host} への ping ' + ('成功' if reachable else '失敗')
+            'detail': f'{self.host} のSMBポート（445/139）への接続' + ('成功' if reachable else '失敗')
         })
 
         if not reachable:
             results['overall'] = 'error'
             return results
 
-        # 3. SMB接続確認
-        nas_info = self.get_nas_info()
-        results['tests'].append({
-            'name': 'SMB接続 (smbclient)',
-            'status': 'ok' if nas_info['success'] else 'warning',
-            'detail': f"共有: {', '.join([s['name'] for s in nas_info.get('shares', [])])}" if nas_info['success'] else nas_info.get('error', '不明')
-        })
-
-        # 4. マウント状態
+        # 3. マウント状態
         connected = self.is_connected()
         results['tests'].append({
             'name': 'マウント状態',
@@ -377,6 +448,13 @@ class NASChecker:
         })
 
         if not connected:
+            # 4. SMB接続確認（smbclient は数秒かかるため、マウントできていない場合のみ原因調査に実行）
+            nas_info = self.get_nas_info()
+            results['tests'].append({
+                'name': 'SMB接続 (smbclient)',
+                'status': 'ok' if nas_info['success'] else 'warning',
+                'detail': f"共有: {', '.join([s['name'] for s in nas_info.get('shares', [])])}" if nas_info['success'] else nas_info.get('error', '不明')
+            })
             results['overall'] = 'error'
             return results
 
@@ -445,6 +523,32 @@ def check_nas_on_startup():
         return False, "NASマウント失敗: バックアップ機能は無効です", True
 
 
+FSTAB_PATH = '/etc/fstab'
+
+# /etc/fstab のマウントポイント一覧キャッシュ（mtime が変わった時のみ再読込）
+_fstab_cache = {'mtime': None, 'mount_points': frozenset()}
+
+
+def _fstab_mount_points():
+    """/etc/fstab の有効行（コメント除外）のマウントポイント集合を取得"""
+    mtime = os.stat(FSTAB_PATH).st_mtime
+    if _fstab_cache['mtime'] != mtime:
+        mount_points = set()
+        with open(FSTAB_PATH, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and not fields[0].startswith('#'):
+                    mount_points.add(fields[1])
+        _fstab_cache['mount_points'] = frozenset(mount_points)
+        _fstab_cache['mtime'] = mtime
+    return _fstab_cache['mount_points']
+
+
+def is_in_fstab(mount_point):
+    """指定マウントポイントのエントリが /etc/fstab に存在するか確認（コメント行は除外）"""
+    return mount_point in _fstab_mount_points()
+
+
 def generate_fstab_entry():
     """fstabエントリを生成（直結運用用）"""
     checker = NASChecker()
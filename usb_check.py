@@ -6,59 +6,135 @@ import os
 import subprocess
 import platform
 import re
-from config import Config
+import time
+
+# OS ごとの確認方法（macOS: diskutil / Linux: mountinfo）の振り分けに使用
+_SYSTEM = platform.system()
+
+# マウント状態のキャッシュ時間（秒）: findmnt / diskutil などの起動を抑える
+_MOUNT_TTL = 3.0
+
+# 外部コマンドのタイムアウト（秒）。system_profiler は遅いため長め
+_COMMAND_TIMEOUT = 10
+_PROFILER_TIMEOUT = 30
+
+
+def get_usb_settings(defaults):
+    """
+    複数のUSB設定をまとめて取得（AppSettings優先、フォールバック: Config → defaults）
+    defaults: {key: default}（key は 'usb_' を除いた名前）
+    Returns: {key: value}
+    """
+    from models import AppSettings
+    return AppSettings.get_prefixed('usb_', defaults)
 
 
 def get_usb_setting(key, default=None):
     """AppSettingsからUSB設定を取得（フォールバック: Config）"""
-    try:
-        from flask import has_app_context
-        if has_app_context():
-            from models import AppSettings
-            value = AppSettings.get(f'usb_{key}')
-            if value is not None and value != '':
-                return value
-    except (RuntimeError, ImportError):
-        # Flaskコンテキスト外
-        pass
-
-    # Config からフォールバック
-    config_key = f'USB_{key.upper()}'
-    return getattr(Config, config_key, default)
+    return get_usb_settings({key: default})[key]
+
+
+_MOUNTINFO_ESCAPE_RE = re.compile(r'\\([0-7]{3})')
+
+
+def find_mount_point(device):
+    """/proc/self/mountinfo からブロックデバイスのマウントポイントを取得（未マウントは None）
+
+    device: /dev/sdb1 などの実デバイスパス（シンボリックリンク解決済み）
+    """
+    st = os.stat(device)
+    dev_id = f'{os.major(st.st_rdev)}:{os.minor(st.st_rdev)}'
+    with open('/proc/self/mountinfo', encoding='utf-8', errors='surrogateescape') as f:
+        for line in f:
+            # 形式: ID 親ID major:minor root マウントポイント オプション [任意項目...] - FS種別 ソース 追加オプション
+            head, sep, tail = line.partition(' - ')
+            if not sep:
+                continue
+            fields = head.split(' ')
+            if fields[3] != '/':
+                continue  # サブディレクトリの bind マウントは対象外
+            parts = tail.split(' ')
+            source = parts[1] if len(parts) > 1 else ''
+            if fields[2] == dev_id or source == device or (
+                    source.startswith('/dev/') and os.path.realpath(source) == device):
+                # マウントポイント中の空白などは \040 のような8進エスケープになっている
+                return _MOUNTINFO_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), fields[4])
+    return None
+
+
+def _iter_ioreg_usb_devices(root):
+    """ioreg のツリーを辿ってUSBデバイス情報を順に返す"""
+    stack = [root]
+    while stack:
+        entry = stack.pop()
+        stack.extend(reversed(entry.get('IORegistryEntryChildren', [])))
+        if 'idVendor' not in entry:
+            continue  # ルートハブ等
+        device = {'name': entry.get('USB Product Name') or entry.get('IORegistryEntryName', '')}
+        serial = entry.get('USB Serial Number') or entry.get('kUSBSerialNumberString')
+        if serial:
+            device['serial'] = serial
+        device['vendor_id'] = f"0x{entry['idVendor']:04x}"
+        if 'idProduct' in entry:
+            device['product_id'] = f"0x{entry['idProduct']:04x}"
+        yield device
 
 
 class USBChecker:
     """USBメモリの接続状態を確認"""
 
     def __init__(self):
-        self.system = platform.system()
-        # AppSettings優先で設定を読み込み
-        self.uuid = get_usb_setting('uuid', '')
-        self.mount_point = get_usb_setting('mount_point', '/media/usb_backup')
-        required_val = get_usb_setting('required', 'true')
-        self.required = str(required_val).lower() == 'true'
-        self.backup_folder = get_usb_setting('backup_folder', 'barcode_app_backups')
-
-    def is_connected(self):
-        """USBが接続されているか確認"""
+        self.system = _SYSTEM
+        # AppSettings優先で設定を読み込み（1回のクエリ、以降はキャッシュ）
+        settings = get_usb_settings({
+            'uuid': '',
+            'mount_point': '/media/usb_backup',
+            'required': 'true',
+            'backup_folder': 'barcode_app_backups',
+        })
+        self.uuid = settings['uuid']
+        self.mount_point = settings['mount_point']
+        self.required = str(settings['required']).lower() == 'true'
+        self.backup_folder = settings['backup_folder']
+        self._mount_cache = None
+
+    def status(self):
+        """
+        接続状態とマウントポイントを確認（結果は _MOUNT_TTL 秒キャッシュ）
+        is_connected / get_mount_point / get_status はすべてここを通す
+        Returns: (connected: bool, mount_point: str)
+        """
         if not self.uuid:
             # UUIDが設定されていない場合は開発モードとして許可
-            return True
+            return True, self.mount_point
+
+        if self._mount_cache and time.monotonic() - self._mount_cache[0] < _MOUNT_TTL:
+            _, connected, self.mount_point = self._mount_cache
+            return connected, self.mount_point
 
         if self.system == 'Darwin':
-            return self._check_macos()
+            connected = self._check_macos()
         elif self.system == 'Linux':
-            return self._check_linux()
+            connected = self._check_linux()
         else:
             # 未対応OSは許可
-            return True
+            connected = True
+        self._mount_cache = (time.monotonic(), connected, self.mount_point)
+        return connected, self.mount_point
+
+    def is_connected(self):
+        """USBが接続されているか確認"""
+        return self.status()[0]
+
+    def invalidate_mount_cache(self):
+        """マウント状態のキャッシュを破棄"""
+        self._mount_cache = None
 
     def is_usb_valid(self):
         """設定されたUSBデバイスIDと一致するか検証"""
         # 動的に設定を読み込む（AppSettingsから）
         try:
-            from models import AppSettings
-            usb_device_id = AppSettings.get('usb_device_id', '')
+            usb_device_id = get_usb_setting('device_id', '')
         except Exception:
             usb_device_id = ''
 
@@ -76,14 +152,23 @@ class USBChecker:
     def _validate_macos_device(self, device_id):
         """macOSでUSBデバイスIDを検証"""
         try:
-            # system_profilerでUSBデバイス一覧を取得
-            result = subprocess.run(
-                ['system_profiler', 'SPUSBDataType'],
-                capture_output=True,
-                text=True
-            )
+            root = self._load_ioreg_usb_tree()
+            if root is not None:
+                # 見つかった時点で走査を打ち切る
+                found = any(
+                    device_id in ' '.join(str(value) for value in device.values())
+                    for device in _iter_ioreg_usb_devices(root)
+                )
+            else:
+                # ioreg が使えない場合のみ system_profiler（数秒かかる）
+                result = subprocess.run(
+                    ['system_profiler', 'SPUSBDataType'],
+                    capture_output=True,
+                    timeout=_PROFILER_TIMEOUT
+                )
+                found = device_id.encode() in result.stdout
 
-            if device_id in result.stdout:
+            if found:
                 # デバイスIDが見つかったらマウントポイントを確認
                 return self._find_mounted_usb()
 
@@ -98,10 +183,11 @@ class USBChecker:
             result = subprocess.run(
                 ['lsusb'],
                 capture_output=True,
-                text=True
+                timeout=_COMMAND_TIMEOUT
             )
 
-            if device_id in result.stdout:
+            # 出力はデコードせずバイト列のまま検索
+            if device_id.encode() in result.stdout:
                 return self.is_connected()
 
             return False
@@ -133,54 +219,93 @@ class USBChecker:
 
         return devices
 
-    def _get_macos_usb_devices(self):
-        """macOSで接続中のUSBデバイス情報を取得"""
-        devices = []
+    def _load_ioreg_usb_tree(self):
+        """ioreg（IOKit）からUSBツリーを取得（失敗時は None）"""
         try:
             result = subprocess.run(
-                ['system_profiler', 'SPUSBDataType', '-detailLevel', 'mini'],
+                ['ioreg', '-p', 'IOUSB', '-a', '-l'],
                 capture_output=True,
-                text=True
+                timeout=_COMMAND_TIMEOUT
             )
+            if result.returncode != 0 or not result.stdout:
+                return None
+            import plistlib
+            return plistlib.loads(result.stdout)
+        except Exception:
+            return None
+
+    def _iter_macos_usb_devices(self):
+        """macOSで接続中のUSBデバイス情報を順に返す（ioreg、使えない場合は system_profiler）"""
+        root = self._load_ioreg_usb_tree()
+        if root is not None:
+            yield from _iter_ioreg_usb_devices(root)
+            return
+
+        result = subprocess.run(
+            ['system_profiler', 'SPUSBDataType', '-detailLevel', 'mini'],
+            capture_output=True,
+            timeout=_PROFILER_TIMEOUT
+        )
+
+        # シンプルなパース
+        current_device = {}
+        for line in result.stdout.decode('utf-8', 'replace').split('\n'):
+            line = line.strip()
+            if ':' in line:
+                if line.endswith(':') and not line.startswith('USB'):
+                    # デバイス名
+                    if current_device:
+                        yield current_device
+                    current_device = {'name': line[:-1]}
+                elif 'Serial Number:' in line:
+                    current_device['serial'] = line.split(':')[1].strip()
+                elif 'Vendor ID:' in line:
+                    current_device['vendor_id'] = line.split(':')[1].strip()
+                elif 'Product ID:' in line:
+                    current_device['product_id'] = line.split(':')[1].strip()
+
+        if current_device:
+            yield current_device
 
-            # シンプルなパース
-            current_device = {}
-            for line in result.stdout.split('\n'):
-                line = line.strip()
-                if ':' in line:
-                    if line.endswith(':') and not line.startswith('USB'):
-                        # デバイス名
-                        if current_device:
-                            devices.append(current_device)
-                        current_device = {'name': line[:-1]}
-                    elif 'Serial Number:' in line:
-                        current_device['serial'] = line.split(':')[1].strip()
-                    elif 'Vendor ID:' in line:
-                        current_device['vendor_id'] = line.split(':')[1].strip()
-                    elif 'Product ID:' in line:
-                        current_device['product_id'] = line.split(':')[1].strip()
-
-            if current_device:
-                devices.append(current_device)
-
+    def _get_macos_usb_devices(self):
+        """macOSで接続中のUSBデバイス情報を取得"""
+        try:
             # シリアル番号があるデバイスのみ返す
-            return [d for d in devices if d.get('serial')]
-
+            return [d for d in self._iter_macos_usb_devices() if d.get('serial')]
         except Exception:
             return []
 
     def _get_linux_usb_devices(self):
-        """LinuxでUSBデバイス情報を取得"""
+        """LinuxでUSBデバイス情報を取得（sysfs を直接読む）"""
+        sysfs_path = '/sys/bus/usb/devices'
+        if os.path.isdir(sysfs_path):
+            devices = []
+            with os.scandir(sysfs_path) as it:
+                for entry in it:
+                    try:
+                        with open(os.path.join(entry.path, 'serial')) as f:
+                            serial = f.read().strip()
+                        with open(os.path.join(entry.path, 'idVendor')) as f:
+                            vendor_id = f.read().strip()
+                        with open(os.path.join(entry.path, 'idProduct')) as f:
+                            product_id = f.read().strip()
+                    except OSError:
+                        continue  # シリアル番号のないデバイス・インターフェース
+                    if serial and serial != '0':
+                        devices.append({'serial': serial, 'vendor_id': vendor_id, 'product_id': product_id})
+            return devices
+
+        # sysfs がない環境のみ lsusb -v でフォールバック
         devices = []
         try:
             result = subprocess.run(
                 ['lsusb', '-v'],
                 capture_output=True,
-                text=True
+                timeout=_COMMAND_TIMEOUT
             )
 
             # シンプルなパース
-            for line in result.stdout.split('\n'):
+            for line in result.stdout.decode('utf-8', 'replace').split('\n'):
                 if 'iSerial' in line and 'Serial' in line:
                     parts = line.split()
                     if len(parts) > 2:
@@ -198,11 +323,22 @@ class USBChecker:
             # /dev/disk/by-uuid/ でUUIDを確認
             uuid_path = f'/dev/disk/by-uuid/{self.uuid}'
             if os.path.exists(uuid_path):
-                # マウントされているか確認
+                # mountinfo を直接読んでマウントされているか確認（読めない場合のみ findmnt）
+                try:
+                    mount_point = find_mount_point(os.path.realpath(uuid_path))
+                except OSError:
+                    pass
+                else:
+                    if mount_point:
+                        self.mount_point = mount_point
+                        return True
+                    return False
+
                 result = subprocess.run(
                     ['findmnt', '-n', '-o', 'TARGET', uuid_path],
                     capture_output=True,
-                    text=True
+                    text=True,
+                    timeout=_COMMAND_TIMEOUT
                 )
                 if result.returncode == 0 and result.stdout.strip():
                     self.mount_point = result.stdout.strip()
@@ -212,7 +348,8 @@ class USBChecker:
             result = subprocess.run(
                 ['lsblk', '-o', 'UUID,MOUNTPOINT', '-n'],
                 capture_output=True,
-                text=True
+                text=True,
+                timeout=_COMMAND_TIMEOUT
             )
             for line in result.stdout.strip().split('\n'):
                 parts = line.split()
@@ -227,48 +364,74 @@ class USBChecker:
     def _check_macos(self):
         """macOS でのUSB確認"""
         try:
-            # diskutil でボリュームを確認
+            # UUID を diskutil に直接渡して1回で確認
             result = subprocess.run(
-                ['diskutil', 'list', '-plist'],
+                ['diskutil', 'info', '-plist', self.uuid],
                 capture_output=True,
-                text=True
+                timeout=_COMMAND_TIMEOUT
             )
+            if result.returncode == 0:
+                import plistlib
+                mount_point = plistlib.loads(result.stdout).get('MountPoint')
+                if mount_point:
+                    self.mount_point = mount_point
+                    return True
+                return False
 
-            # /Volumes/ ディレクトリをチェック
-            volumes_path = '/Volumes'
-            if os.path.exists(volumes_path):
-                for volume in os.listdir(volumes_path):
-                    volume_path = os.path.join(volumes_path, volume)
-                    if os.path.ismount(volume_path):
-                        # diskutil info でUUIDを確認
-                        try:
-                            info_result = subprocess.run(
-                                ['diskutil', 'info', volume_path],
-                                capture_output=True,
-                                text=True
-                            )
-                            if self.uuid in info_result.stdout:
-                                self.mount_point = volume_path
-                                return True
-                        except Exception:
-                            continue
+            # diskutil が識別子として受け付けない UUID（FAT のシリアル等）は /Volumes を走査
+            return self._find_volume_by_uuid()
+        except Exception:
+            return False
 
+    def _find_volume_by_uuid(self):
+        """/Volumes 配下のボリュームを diskutil info で確認（ボリュームごとに並列実行）"""
+        volumes_path = '/Volumes'
+        if not os.path.exists(volumes_path):
             return False
-        except Exception:
+        volume_paths = [
+            path for path in (os.path.join(volumes_path, v) for v in os.listdir(volumes_path))
+            if os.path.ismount(path)
+        ]
+        if not volume_paths:
+            return False
+
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        uuid = self.uuid.encode()
+
+        def probe(volume_path):
+            info_result = subprocess.run(
+                ['diskutil', 'info', volume_path],
+                capture_output=True,
+                timeout=_COMMAND_TIMEOUT
+            )
+            return uuid in info_result.stdout
+
+        executor = ThreadPoolExecutor(max_workers=min(8, len(volume_paths)))
+        try:
+            futures = {executor.submit(probe, path): path for path in volume_paths}
+            for future in as_completed(futures):
+                try:
+                    if future.result():
+                        self.mount_point = futures[future]
+                        return True
+                except Exception:
+                    continue
             return False
+        finally:
+            # 見つかった時点で残りの確認は待たない
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def get_mount_point(self):
         """マウントポイントを取得"""
-        if self.is_connected():
-            return self.mount_point
-        return None
+        connected, mount_point = self.status()
+        return mount_point if connected else None
 
     def get_status(self):
         """現在の状態を取得"""
-        connected = self.is_connected()
+        connected, mount_point = self.status()
         return {
             'connected': connected,
-            'mount_point': self.mount_point if connected else None,
+            'mount_point': mount_point if connected else None,
             'uuid': self.uuid,
             'required': self.required,
             'system': self.system
@@ -285,8 +448,9 @@ def check_usb_on_startup():
     if not checker.uuid:
         return True, "USB設定なし（開発モード）", True
 
-    if checker.is_connected():
-        return True, f"USB接続確認済み: {checker.mount_point}", True
+    connected, mount_point = checker.status()
+    if connected:
+        return True, f"USB接続確認済み: {mount_point}", True
 
     if checker.required:
         return False, "USB未検出: アプリを起動できません。USBメモリを接続してください。", False
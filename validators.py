@@ -2,7 +2,11 @@
 入力バリデーション
 アプリケーション全体で使用する入力検証関数
 """
-import re
+# 制御文字の削除テーブル（str.translate で1パス除去。isprintable() な文字列は変換不要）
+_CTRL_CHARS = [*range(0x20), 0x7f]
+_STRIP_CTRL = dict.fromkeys(_CTRL_CHARS)
+# 改行（LF/CR）とタブは残す
+_STRIP_CTRL_KEEP_NL = dict.fromkeys(c for c in _CTRL_CHARS if c not in (0x09, 0x0a, 0x0d))
 
 
 # 入力制限値
@@ -16,6 +20,17 @@ LIMITS = {
     'return_days_max': 365,   # 返却期限最大日数
 }
 
+# 各バリデータで参照する上限値（LIMITS は外部参照用に残す）
+_LIMIT_BARCODE = LIMITS['barcode']
+_LIMIT_PATIENT_ID = LIMITS['patient_id']
+_LIMIT_NOTES = LIMITS['notes']
+_LIMIT_USER_NAME = LIMITS['user_name']
+_LIMIT_PASSWORD = LIMITS['password']
+_LIMIT_QUANTITY_MAX = LIMITS['quantity_max']
+_LIMIT_RETURN_DAYS_MAX = LIMITS['return_days_max']
+# sanitize_input で切り詰める文字列の最大長
+_MAX_INPUT_LENGTH = 10000
+
 
 class ValidationError(Exception):
     """バリデーションエラー"""
@@ -50,8 +65,9 @@ def validate_string(value, field_name, max_length, required=False, allow_none=Tr
     if not isinstance(value, str):
         raise ValidationError(f'{field_name}は文字列で入力してください', field_name)
 
-    # 前後の空白を除去
-    value = value.strip()
+    # 前後の空白を除去（両端が空白でなければ新しい文字列を作らない）
+    if value and (value[0].isspace() or value[-1].isspace()):
+        value = value.strip()
 
     if not value:
         if required:
@@ -103,45 +119,45 @@ def validate_integer(value, field_name, min_val=0, max_val=None, default=0):
 
 def validate_barcode(value, required=False):
     """バーコードバリデーション"""
-    value = validate_string(value, 'バーコード', LIMITS['barcode'], required=required)
+    value = validate_string(value, 'バーコード', _LIMIT_BARCODE, required=required)
 
-    if value:
+    if value and not value.isprintable():
         # 制御文字を除去（改行、タブなど）
-        value = re.sub(r'[\x00-\x1f\x7f]', '', value)
+        value = value.translate(_STRIP_CTRL)
 
     return value
 
 
 def validate_patient_id(value):
     """患者IDバリデーション"""
-    value = validate_string(value, '患者ID', LIMITS['patient_id'])
+    value = validate_string(value, '患者ID', _LIMIT_PATIENT_ID)
 
-    if value:
+    if value and not value.isprintable():
         # 制御文字を除去
-        value = re.sub(r'[\x00-\x1f\x7f]', '', value)
+        value = value.translate(_STRIP_CTRL)
 
     return value
 
 
 def validate_notes(value):
     """メモバリデーション"""
-    value = validate_string(value, 'メモ', LIMITS['notes'])
+    value = validate_string(value, 'メモ', _LIMIT_NOTES)
 
-    if value:
+    if value and not value.isprintable():
         # 改行は許可するが、その他の制御文字は除去
-        value = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]', '', value)
+        value = value.translate(_STRIP_CTRL_KEEP_NL)
 
     return value
 
 
 def validate_user_name(value, required=True):
     """ユーザー名バリデーション"""
-    return validate_string(value, 'ユーザー名', LIMITS['user_name'], required=required)
+    return validate_string(value, 'ユーザー名', _LIMIT_USER_NAME, required=required)
 
 
 def validate_password(value, required=False):
     """パスワードバリデーション"""
-    return validate_string(value, 'パスワード', LIMITS['password'], required=required)
+    return validate_string(value, 'パスワード', _LIMIT_PASSWORD, required=required)
 
 
 def validate_quantity(value, field_name='個数', default=0):
@@ -150,7 +166,7 @@ def validate_quantity(value, field_name='個数', default=0):
         value,
         field_name,
         min_val=0,
-        max_val=LIMITS['quantity_max'],
+        max_val=_LIMIT_QUANTITY_MAX,
         default=default
     )
 
@@ -161,7 +177,7 @@ def validate_return_days(value):
         value,
         '返却期限日数',
         min_val=1,
-        max_val=LIMITS['return_days_max'],
+        max_val=_LIMIT_RETURN_DAYS_MAX,
         default=14
     )
 
@@ -179,12 +195,9 @@ def sanitize_input(data):
     if not isinstance(data, dict):
         return {}
 
-    sanitized = {}
-    for key, value in data.items():
-        if isinstance(value, str):
-            # 文字列の場合、最大10000文字に制限
-            sanitized[key] = value[:10000]
-        else:
-            sanitized[key] = value
-
-    return sanitized
+    # 文字列の場合、最大10000文字に制限（上限内ならそのまま）
+    return {
+        key: value[:_MAX_INPUT_LENGTH]
+        if isinstance(value, str) and len(value) > _MAX_INPUT_LENGTH else value
+        for key, value in data.items()
+    }